@@ -0,0 +1,349 @@
+"""
+ASGI entry point for the read-heavy endpoints.
+
+    uvicorn asgi:app --workers 2
+
+/api/properties, /api/estimate_price and /browse are served with async
+database access (aiosqlite / asyncpg), so a slow query only parks a coroutine
+instead of a whole worker. /api/properties/changes (with long-polling) and
+/api/properties/changes/stream (server-sent events) serve the change feed,
+waiting on one shared poller per worker. Database work is bounded per worker by
+ASGI_MAX_CONCURRENCY; requests that wait longer than ASGI_QUEUE_TIMEOUT seconds
+for a slot get a 503. Every other route falls through to the Flask app, so
+this module is the Procfile's web process (workers from WEB_CONCURRENCY).
+The sync app alone (gunicorn --preload object_app:app) serves everything
+except the long-poll and the event stream.
+"""
+import os
+import json
+import asyncio
+
+from a2wsgi import WSGIMiddleware
+from flask import render_template
+from sqlalchemy import event, func, select
+from sqlalchemy.ext.asyncio import create_async_engine
+from starlette.applications import Starlette
+from starlette.responses import HTMLResponse, JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+from object_app import (
+    app as flask_app, database_url, db, engine_options, Property, PropertyChange, API_PAGE_SIZE_MAX,
+    API_STREAM_BATCH_SIZE, BROWSE_PAGE_SIZE, CHANGES_MAX_WAIT, CHANGES_POLL_INTERVAL,
+    browse_filters, browse_order, change_entry, change_notifier, estimate_property_price,
+    filter_properties, parse_fields, parse_page_size, property_changes_query, search_index,
+)
+
+ASGI_MAX_CONCURRENCY = int(os.environ.get('ASGI_MAX_CONCURRENCY', 32))
+ASGI_QUEUE_TIMEOUT = float(os.environ.get('ASGI_QUEUE_TIMEOUT', 10))
+SSE_KEEPALIVE_SECONDS = 15
+
+# --- Async engine ---
+
+def async_database_url(url):
+    """Swap the sync driver for its asyncio counterpart"""
+    if url.startswith('sqlite:'):
+        return url.replace('sqlite:', 'sqlite+aiosqlite:', 1)
+    if url.startswith('postgresql:') or url.startswith('postgresql+psycopg2:'):
+        return 'postgresql+asyncpg:' + url.split(':', 1)[1]
+    return url
+
+def async_engine_options(url):
+    """engine_options() translated for the asyncio drivers"""
+    options = engine_options(url)
+    connect_args = options.pop('connect_args', {})
+    if 'options' in connect_args:
+        # asyncpg takes server settings instead of a libpq options string
+        timeout = connect_args['options'].split('=', 1)[1]
+        options['connect_args'] = {'server_settings': {'statement_timeout': timeout}}
+    elif connect_args:
+        options['connect_args'] = connect_args
+    return options
+
+# The URL as Flask-SQLAlchemy resolved it: a relative SQLite path points into
+# the instance folder, and both apps must open the same file
+with flask_app.app_context():
+    resolved_url = db.engine.url.render_as_string(hide_password=False)
+
+engine = create_async_engine(async_database_url(resolved_url), **async_engine_options(database_url))
+
+if database_url.startswith('sqlite'):
+    @event.listens_for(engine.sync_engine, 'connect')
+    def configure_sqlite_connection(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.close()
+
+class ConcurrencyLimit:
+    """Async context manager that caps in-flight database work per worker"""
+
+    def __init__(self, limit, timeout):
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(limit)
+
+    async def __aenter__(self):
+        await asyncio.wait_for(self._semaphore.acquire(), self.timeout)
+
+    async def __aexit__(self, *exc):
+        self._semaphore.release()
+
+db_limit = ConcurrencyLimit(ASGI_MAX_CONCURRENCY, ASGI_QUEUE_TIMEOUT)
+
+def error(message, status):
+    return JSONResponse({'success': False, 'error': message}, status_code=status)
+
+# --- Endpoints ---
+
+async def api_get_properties(request):
+    """Async twin of object_app.api_get_properties (same args and response)"""
+    args = request.query_params
+    try:
+        fields = parse_fields(args.get('fields'))
+        limit = parse_page_size(args.get('limit'))
+        cursor = int(args['cursor']) if args.get('cursor') else None
+        descending = args.get('order', 'asc') == 'desc'
+        page = max(1, int(args.get('page') or 1))
+    except ValueError as e:
+        return error(str(e), 400)
+    columns = [getattr(Property, f) for f in fields]
+
+    if args.get('q'):
+        query = (search_index.match(select(*columns), args['q'])
+                 .order_by(search_index.rank(args['q']), Property.id.desc())
+                 .offset((page - 1) * limit)
+                 .limit(limit + 1))
+        try:
+            async with db_limit, engine.connect() as conn:
+                rows = [dict(zip(fields, row)) for row in await conn.execute(query)]
+        except asyncio.TimeoutError:
+            return error('Server busy, try again', 503)
+        return JSONResponse({
+            'success': True,
+            'count': len(rows[:limit]),
+            'properties': rows[:limit],
+            'page': page,
+            'next_page': page + 1 if len(rows) > limit else None
+        })
+
+    if args.get('stream') in ('1', 'true'):
+        return StreamingResponse(stream_properties(fields, columns), media_type='application/json')
+
+    query = select(*columns)
+    if cursor is not None:
+        query = query.where(Property.id < cursor if descending else Property.id > cursor)
+    query = query.order_by(Property.id.desc() if descending else Property.id.asc()).limit(limit + 1)
+    try:
+        async with db_limit, engine.connect() as conn:
+            rows = [dict(zip(fields, row)) for row in await conn.execute(query)]
+    except asyncio.TimeoutError:
+        return error('Server busy, try again', 503)
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return JSONResponse({
+        'success': True,
+        'count': len(rows),
+        'properties': rows,
+        'next_cursor': rows[-1]['id'] if has_more else None
+    })
+
+async def stream_properties(fields, columns):
+    """Keyset batches of the whole inventory, holding a concurrency slot only per batch"""
+    yield '{"success": true, "properties": ['
+    cursor = None
+    count = 0
+    while True:
+        query = select(*columns).order_by(Property.id).limit(API_STREAM_BATCH_SIZE)
+        if cursor is not None:
+            query = query.where(Property.id > cursor)
+        async with db_limit, engine.connect() as conn:
+            batch = [dict(zip(fields, row)) for row in await conn.execute(query)]
+        if not batch:
+            break
+        yield ('' if count == 0 else ',') + ','.join(json.dumps(row, ensure_ascii=False) for row in batch)
+        count += len(batch)
+        cursor = batch[-1]['id']
+    yield '], "count": %d}' % count
+
+async def api_estimate_price(request):
+    """Async twin of object_app.api_estimate_price (CPU only, unless market pricing is on)"""
+    try:
+        data = await request.json()
+        district = data.get('district', 'Riyadh')
+        area = float(data.get('area', 0))
+        rooms = int(data.get('rooms', 0))
+        bathrooms = int(data.get('bathrooms', 0))
+        age = int(data.get('age', 0))
+        furnished = data.get('furnished', 'no')
+
+        # App context so PRICING_MARKET_WEIGHT sees the market stats, as in the sync view
+        with flask_app.app_context():
+            estimated, low, high = estimate_property_price(
+                district, area, rooms, bathrooms, age, furnished
+            )
+        return JSONResponse({
+            'success': True,
+            'estimated_price': estimated,
+            'price_range_low': low,
+            'price_range_high': high
+        })
+    except Exception as e:
+        return error(str(e), 400)
+
+async def browse(request):
+    """
+    /browse with the listing query run asynchronously; the page is then
+    rendered by Flask's Jinja environment in a request context built from the
+    incoming path, query string and cookies, so it is identical to the sync view.
+    """
+    args = request.query_params
+    try:
+        page = max(1, int(args.get('page') or 1))
+        per_page = parse_page_size(args.get('per_page'), default=BROWSE_PAGE_SIZE)
+        query = (filter_properties(select(Property.__table__), args)
+                 .order_by(*browse_order(args))
+                 .offset((page - 1) * per_page)
+                 .limit(per_page + 1))
+    except ValueError:
+        page, per_page, query = 1, BROWSE_PAGE_SIZE, None
+
+    properties = []
+    if query is not None:
+        try:
+            async with db_limit, engine.connect() as conn:
+                properties = [row._mapping for row in await conn.execute(query)]
+        except asyncio.TimeoutError:
+            return HTMLResponse('Server busy, try again', status_code=503)
+    has_next = len(properties) > per_page
+
+    filters = browse_filters(args)
+    headers = {'Cookie': request.headers['cookie']} if 'cookie' in request.headers else {}
+    with flask_app.test_request_context(request.url.path, query_string=request.url.query, headers=headers):
+        html = render_template('browse.html', properties=properties[:per_page], page=page,
+                               has_next=has_next, filters=filters)
+    return HTMLResponse(html)
+
+class ChangeBroadcaster:
+    """
+    Shared by every change stream in this worker: while anyone is waiting, one
+    task re-reads the latest sequence each CHANGES_POLL_INTERVAL, or at once
+    when the Flask app commits a change in this process, and wakes the
+    streams that are behind it. Polling costs one query per worker, not per client.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.latest = 0
+        self._waiting = 0
+        self._condition = asyncio.Condition()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._loop = None
+        change_notifier.subscribe(self._notified)
+
+    def _notified(self):
+        # Called from the thread that committed
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _poll(self):
+        while self._waiting:
+            try:
+                async with db_limit, engine.connect() as conn:
+                    latest = await conn.scalar(select(func.max(PropertyChange.seq))) or 0
+            except asyncio.TimeoutError:
+                latest = self.latest  # Busy worker, try again next interval
+            if latest != self.latest:
+                self.latest = latest
+                async with self._condition:
+                    self._condition.notify_all()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def wait(self, since, timeout):
+        """True once a change after `since` has committed, False after `timeout` seconds"""
+        self._loop = asyncio.get_running_loop()
+        self._waiting += 1
+        try:
+            if self._task is None or self._task.done():
+                self._task = asyncio.create_task(self._poll())
+            async with self._condition:
+                await asyncio.wait_for(self._condition.wait_for(lambda: self.latest > since), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._waiting -= 1
+
+broadcaster = ChangeBroadcaster(CHANGES_POLL_INTERVAL)
+
+async def fetch_changes(since, fields, limit):
+    """Page of the change feed: (entries, has_more)"""
+    async with db_limit, engine.connect() as conn:
+        rows = (await conn.execute(property_changes_query(since, fields, limit + 1))).all()
+    return [change_entry(row, fields) for row in rows[:limit]], len(rows) > limit
+
+async def api_property_changes(request):
+    """
+    Async twin of object_app.api_property_changes that also long-polls:
+    with wait=<seconds> (max CHANGES_MAX_WAIT) an empty page is held until a
+    change commits, without a database query per waiting client.
+    """
+    args = request.query_params
+    try:
+        since = max(0, int(args.get('since') or 0))
+        limit = parse_page_size(args.get('limit'))
+        fields = parse_fields(args.get('fields'))
+        wait = min(max(0.0, float(args.get('wait') or 0)), CHANGES_MAX_WAIT)
+    except ValueError as e:
+        return error(str(e), 400)
+    try:
+        changes, has_more = await fetch_changes(since, fields, limit)
+        if not changes and wait and await broadcaster.wait(since, wait):
+            changes, has_more = await fetch_changes(since, fields, limit)
+    except asyncio.TimeoutError:
+        return error('Server busy, try again', 503)
+    return JSONResponse({
+        'success': True,
+        'count': len(changes),
+        'changes': changes,
+        'next_since': changes[-1]['seq'] if changes else since,
+        'has_more': has_more
+    })
+
+async def stream_changes(request):
+    """
+    Server-sent events twin of /api/properties/changes: one `change` event
+    per feed entry, with the entry's seq as the event id, so a reconnecting
+    EventSource resumes from Last-Event-ID. Takes `since` and `fields`.
+    """
+    args = request.query_params
+    try:
+        since = max(0, int(args.get('since') or request.headers.get('last-event-id') or 0))
+        fields = parse_fields(args.get('fields'))
+    except ValueError as e:
+        return error(str(e), 400)
+    return StreamingResponse(change_events(since, fields), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+async def change_events(since, fields):
+    yield 'retry: 3000\n\n'
+    while True:
+        changes, has_more = await fetch_changes(since, fields, API_PAGE_SIZE_MAX)
+        for entry in changes:
+            yield f"id: {entry['seq']}\nevent: change\ndata: {json.dumps(entry, ensure_ascii=False)}\n\n"
+            since = entry['seq']
+        if not has_more and not await broadcaster.wait(since, SSE_KEEPALIVE_SECONDS):
+            yield ': keepalive\n\n'
+
+app = Starlette(routes=[
+    Route('/api/properties', api_get_properties, methods=['GET']),
+    Route('/api/properties/changes', api_property_changes, methods=['GET']),
+    Route('/api/properties/changes/stream', stream_changes, methods=['GET']),
+    Route('/api/estimate_price', api_estimate_price, methods=['POST']),
+    Route('/browse', browse, methods=['GET']),
+    Mount('/', app=WSGIMiddleware(flask_app)),
+])
@@ -0,0 +1,410 @@
+"""
+Load-test and benchmark suite for the Flask app.
+
+    python benchmarks/bench_app.py [--rows 1000 10000 100000] [--mode client|gunicorn|both]
+                                   [--requests 200] [--concurrency 8] [--workers 2]
+                                   [--output results.json] [--compare baseline.json]
+
+For every row count a fresh SQLite database is seeded with synthetic
+properties, users and buyer requests spread over the DISTRICT_PRICES
+districts, then each endpoint is driven through the Flask test client and/or
+a local gunicorn. Every (rows, mode, endpoint) reports p50/p95/p99 latency,
+throughput and peak RSS. Each row count runs in its own process, so the
+import-time app configuration and the RSS numbers don't leak between sizes.
+
+--compare exits with status 1 when any p95 is more than --threshold percent
+slower than in the baseline file.
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import http.client
+from urllib.parse import urlencode
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Riyadh bounding box used for synthetic coordinates
+RIYADH_LAT = (24.55, 24.95)
+RIYADH_LNG = (46.50, 46.90)
+PROPERTY_TYPES = ('villa', 'apartment', 'land', 'floor')
+
+ENDPOINTS = ('browse', 'property_details', 'api_properties', 'api_estimate_price', 'api_add_property')
+
+# --- Measurement ---
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(pct / 100 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+def rss_of(pids):
+    """Resident set size in bytes summed over pids, from /proc"""
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    total = 0
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/statm') as f:
+                total += int(f.read().split()[1]) * page_size
+        except (OSError, ValueError, IndexError):
+            pass
+    return total
+
+def process_tree(pid):
+    """pid and all its descendants"""
+    pids = [pid]
+    for p in pids:
+        try:
+            for task in os.listdir(f'/proc/{p}/task'):
+                with open(f'/proc/{p}/task/{task}/children') as f:
+                    pids.extend(int(c) for c in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+class RssSampler:
+    """Sample the RSS of a process tree in the background and keep the peak"""
+
+    def __init__(self, pid, interval=0.005):
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, rss_of(process_tree(self.pid)))
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, rss_of(process_tree(self.pid)))
+
+def summarize(endpoint, latencies, errors, elapsed, peak_rss):
+    latencies = sorted(latencies)
+    ms = lambda v: None if v is None else round(v * 1000, 3)
+    return {
+        'endpoint': endpoint,
+        'requests': len(latencies) + errors,
+        'errors': errors,
+        'p50_ms': ms(percentile(latencies, 50)),
+        'p95_ms': ms(percentile(latencies, 95)),
+        'p99_ms': ms(percentile(latencies, 99)),
+        'throughput_rps': round((len(latencies) + errors) / elapsed, 1) if elapsed else None,
+        'peak_rss_mb': round(peak_rss / 2 ** 20, 1),
+    }
+
+# --- Workload ---
+
+def make_request(endpoint, rng, property_count, districts):
+    """(method, path, json_body) for one synthetic request to an endpoint"""
+    if endpoint == 'browse':
+        args = {'district': rng.choice(districts)} if rng.random() < 0.7 else {}
+        if rng.random() < 0.5:
+            args['type'] = rng.choice(PROPERTY_TYPES)
+        if rng.random() < 0.3:
+            args['price_max'] = rng.randint(500, 5000) * 1000
+        if rng.random() < 0.2:
+            args['page'] = rng.randint(2, 5)
+        return 'GET', '/browse?' + urlencode(args), None
+    if endpoint == 'property_details':
+        return 'GET', f'/property/{rng.randint(1, property_count)}', None
+    if endpoint == 'api_properties':
+        cursor = rng.randint(0, property_count)
+        return 'GET', f'/api/properties?cursor={cursor}&limit=50', None
+    if endpoint == 'api_estimate_price':
+        return 'POST', '/api/estimate_price', random_listing(rng, districts, for_estimate=True)
+    if endpoint == 'api_add_property':
+        return 'POST', '/api/add_property', random_listing(rng, districts)
+    raise ValueError(endpoint)
+
+def random_listing(rng, districts, for_estimate=False):
+    listing = {
+        'district': rng.choice(districts),
+        'area': rng.randint(80, 1500),
+        'rooms': rng.randint(0, 8),
+        'bathrooms': rng.randint(0, 6),
+        'age': rng.randint(0, 40),
+        'furnished': rng.choice(('yes', 'no')),
+    }
+    if not for_estimate:
+        listing.update(
+            title=f'Bench listing {rng.randint(1, 10 ** 9)}',
+            price=rng.randint(300, 9000) * 1000,
+            type=rng.choice(PROPERTY_TYPES),
+            latitude=rng.uniform(*RIYADH_LAT),
+            longitude=rng.uniform(*RIYADH_LNG),
+            description='Synthetic listing generated by the benchmark suite.',
+        )
+    return listing
+
+def seed(app_module, rows, rng):
+    """Insert `rows` properties plus rows/10 users and buyer requests"""
+    db = app_module.db
+    districts = list(app_module.DISTRICT_PRICES)
+    with app_module.app.app_context():
+        app_module.upgrade_schema()
+        users = [{'name': f'user{i}', 'email': f'user{i}@bench.local', 'password': 'x', 'role': 'user'}
+                 for i in range(max(1, rows // 10))]
+        db.session.execute(db.insert(app_module.User), users)
+
+        batch = []
+        for i in range(rows):
+            values = app_module.property_values(random_listing(rng, districts))
+            values['owner_id'] = rng.randint(1, len(users))
+            values.update(app_module.derived_columns(values))
+            batch.append(values)
+            if len(batch) == 5000:
+                db.session.execute(db.insert(app_module.Property), batch)
+                batch = []
+        if batch:
+            db.session.execute(db.insert(app_module.Property), batch)
+
+        leads = []
+        for i in range(max(1, rows // 10)):
+            budget_min = rng.randint(0, 3000) * 1000
+            district = rng.choice(districts)
+            leads.append({
+                'user_name': f'lead{i}', 'phone': '0500000000',
+                'budget_min': budget_min, 'budget_max': budget_min + rng.randint(100, 3000) * 1000,
+                'district': district, 'district_key': app_module.normalize_district(district),
+                'type': rng.choice(PROPERTY_TYPES),
+            })
+        db.session.execute(db.insert(app_module.Request), leads)
+        # Core inserts skip the market stats and change feed events
+        app_module.rebuild_market_stats(db.session.connection())
+        app_module.rebuild_property_changes(db.session.connection())
+        db.session.commit()
+
+# --- Drivers ---
+
+def run_client(app_module, endpoint, count, rows, rng):
+    """Drive one endpoint sequentially through the Flask test client"""
+    client = app_module.app.test_client()
+    districts = list(app_module.DISTRICT_PRICES)
+    latencies, errors = [], 0
+    with RssSampler(os.getpid()) as rss:
+        start = time.perf_counter()
+        for _ in range(count):
+            method, path, body = make_request(endpoint, rng, rows, districts)
+            t0 = time.perf_counter()
+            response = client.open(path, method=method, json=body)
+            elapsed = time.perf_counter() - t0
+            if response.status_code >= 400:
+                errors += 1
+            else:
+                latencies.append(elapsed)
+        total = time.perf_counter() - start
+    return summarize(endpoint, latencies, errors, total, rss.peak)
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def start_gunicorn(workers, env, cwd):
+    port = free_port()
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-w', str(workers), '-b', f'127.0.0.1:{port}',
+         '--chdir', ROOT, '--log-level', 'warning', '--preload', 'object_app:app'],
+        env=env, cwd=cwd,
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/about')
+            conn.getresponse().read()
+            return proc, port
+        except OSError:
+            time.sleep(0.1)
+    proc.terminate()
+    raise RuntimeError('gunicorn did not start')
+
+def run_http(port, pid, endpoint, count, concurrency, rows, districts, seed_value):
+    """Drive one endpoint against gunicorn with `concurrency` keep-alive connections"""
+    local = threading.local()
+    lock = threading.Lock()
+    latencies, errors = [], [0]
+
+    def one(i):
+        conn = getattr(local, 'conn', None)
+        if conn is None:
+            conn = local.conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        method, path, body = make_request(endpoint, random.Random(seed_value + i), rows, districts)
+        payload = None if body is None else json.dumps(body)
+        headers = {'Content-Type': 'application/json'} if payload else {}
+        t0 = time.perf_counter()
+        try:
+            conn.request(method, path, body=payload, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            ok = response.status < 400
+        except (OSError, http.client.HTTPException):
+            local.conn = None
+            ok = False
+        elapsed = time.perf_counter() - t0
+        with lock:
+            if ok:
+                latencies.append(elapsed)
+            else:
+                errors[0] += 1
+
+    with RssSampler(pid) as rss:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(one, range(count)))
+        total = time.perf_counter() - start
+    return summarize(endpoint, latencies, errors[0], total, rss.peak)
+
+def run_size(args):
+    """Seed one database and benchmark every endpoint (runs in a child process)"""
+    workdir = tempfile.mkdtemp(prefix='object-bench-')
+    env = dict(os.environ,
+               DATABASE_URL=f'sqlite:///{os.path.join(workdir, "bench.db")}',
+               CACHE_BACKEND='memory' if args.cache else 'none')
+    os.environ.update(env)
+    os.chdir(workdir)
+    sys.path.insert(0, ROOT)
+    import object_app
+
+    rng = random.Random(args.seed)
+    start = time.perf_counter()
+    seed(object_app, args.size, rng)
+    seed_time = time.perf_counter() - start
+    districts = list(object_app.DISTRICT_PRICES)
+
+    results = []
+    if args.mode in ('client', 'both'):
+        for endpoint in ENDPOINTS:
+            result = run_client(object_app, endpoint, args.requests, args.size, random.Random(args.seed))
+            results.append(dict(result, rows=args.size, mode='client'))
+
+    if args.mode in ('gunicorn', 'both'):
+        # Make sure buffered view counts don't hold the write lock while gunicorn starts
+        with object_app.app.app_context():
+            object_app.view_counter.flush()
+            object_app.db.engine.dispose()
+        proc, port = start_gunicorn(args.workers, env, workdir)
+        try:
+            for endpoint in ENDPOINTS:
+                result = run_http(port, proc.pid, endpoint, args.requests, args.concurrency,
+                                  args.size, districts, args.seed)
+                results.append(dict(result, rows=args.size, mode='gunicorn',
+                                    workers=args.workers, concurrency=args.concurrency))
+        finally:
+            proc.terminate()
+            proc.wait()
+
+    print(json.dumps({'rows': args.size, 'seed_seconds': round(seed_time, 2), 'results': results}))
+
+# --- Reporting ---
+
+def print_table(results):
+    print(f"{'rows':>8} {'mode':<9} {'endpoint':<20} {'reqs':>6} {'err':>4} "
+          f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>9} {'RSS MB':>8}")
+    for r in results:
+        print(f"{r['rows']:>8} {r['mode']:<9} {r['endpoint']:<20} {r['requests']:>6} {r['errors']:>4} "
+              f"{r['p50_ms'] or 0:>9.2f} {r['p95_ms'] or 0:>9.2f} {r['p99_ms'] or 0:>9.2f} "
+              f"{r['throughput_rps'] or 0:>9.1f} {r['peak_rss_mb']:>8.1f}")
+
+def compare(results, baseline_path, threshold):
+    """Print p95 changes against a previous run, returns True when something regressed"""
+    with open(baseline_path) as f:
+        baseline = {(r['rows'], r['mode'], r['endpoint']): r for r in json.load(f)['results']}
+    regressed = False
+    print(f'\nCompared with {baseline_path} (p95, threshold {threshold:.0f}%):')
+    for r in results:
+        old = baseline.get((r['rows'], r['mode'], r['endpoint']))
+        if not old or not old['p95_ms'] or not r['p95_ms']:
+            continue
+        change = (r['p95_ms'] - old['p95_ms']) / old['p95_ms'] * 100
+        flag = ''
+        if change > threshold:
+            flag = '  REGRESSION'
+            regressed = True
+        print(f"  {r['rows']:>8} {r['mode']:<9} {r['endpoint']:<20} "
+              f"{old['p95_ms']:>9.2f} -> {r['p95_ms']:>9.2f} ms ({change:+.1f}%){flag}")
+    return regressed
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[1_000, 10_000, 100_000])
+    parser.add_argument('--mode', choices=('client', 'gunicorn', 'both'), default='both')
+    parser.add_argument('--requests', type=int, default=200, help='Requests per endpoint')
+    parser.add_argument('--concurrency', type=int, default=8, help='Concurrent connections (gunicorn mode)')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--cache', action='store_true', help='Keep the response cache enabled')
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    parser.add_argument('--compare', help='Baseline JSON from a previous --output')
+    parser.add_argument('--threshold', type=float, default=20.0, help='Allowed p95 slowdown in percent')
+    parser.add_argument('--size', type=int, help=argparse.SUPPRESS)  # Internal: run one size
+    args = parser.parse_args()
+
+    if args.size is not None:
+        run_size(args)
+        return
+
+    runs = []
+    for rows in args.rows:
+        cmd = [sys.executable, os.path.abspath(__file__), '--size', str(rows), '--mode', args.mode,
+               '--requests', str(args.requests), '--concurrency', str(args.concurrency),
+               '--workers', str(args.workers), '--seed', str(args.seed)]
+        if args.cache:
+            cmd.append('--cache')
+        print(f'Benchmarking with {rows:,} rows...', file=sys.stderr)
+        output = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, text=True).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+
+    results = [r for run in runs for r in run['results']]
+    print_table(results)
+
+    report = {
+        'meta': {
+            'timestamp': datetime.utcnow().isoformat() + 'Z',
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'requests_per_endpoint': args.requests,
+            'concurrency': args.concurrency,
+            'workers': args.workers,
+            'cache': args.cache,
+            'seed_seconds': {run['rows']: run['seed_seconds'] for run in runs},
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'\nResults written to {args.output}')
+
+    if args.compare and compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
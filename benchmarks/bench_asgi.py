@@ -0,0 +1,98 @@
+"""
+Side-by-side benchmark: the sync Procfile setup (gunicorn object_app:app)
+against the ASGI entry point (uvicorn asgi:app) on the same seeded database.
+
+    python benchmarks/bench_asgi.py [--rows 10000] [--workers 2] [--concurrency 16 64 256]
+                                    [--requests 2000] [--output results.json]
+
+Both servers get the same number of worker processes. Every endpoint served
+by asgi.py is driven at each concurrency level, reporting latency
+percentiles, throughput and errors per server.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import subprocess
+import http.client
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_app import ROOT, free_port, print_table, run_http, seed
+
+ENDPOINTS = ('api_properties', 'api_estimate_price', 'browse')
+
+SERVERS = {
+    'gunicorn-sync': lambda port, workers: [
+        sys.executable, '-m', 'gunicorn', '-w', str(workers), '-b', f'127.0.0.1:{port}',
+        '--log-level', 'warning', '--preload', 'object_app:app'],
+    'uvicorn-asgi': lambda port, workers: [
+        sys.executable, '-m', 'uvicorn', '--workers', str(workers), '--host', '127.0.0.1',
+        '--port', str(port), '--log-level', 'warning', '--no-access-log', 'asgi:app'],
+}
+
+def start_server(name, workers, env):
+    port = free_port()
+    proc = subprocess.Popen(SERVERS[name](port, workers), env=env, cwd=ROOT)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/api/properties?limit=1')
+            conn.getresponse().read()
+            return proc, port
+        except OSError:
+            time.sleep(0.1)
+    proc.terminate()
+    raise RuntimeError(f'{name} did not start')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=10_000)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[16, 64, 256])
+    parser.add_argument('--requests', type=int, default=2000, help='Requests per endpoint and level')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='object-bench-asgi-')
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{os.path.join(workdir, "bench.db")}', CACHE_BACKEND='none')
+    os.environ.update(env)
+    sys.path.insert(0, ROOT)
+    import object_app
+
+    print(f'Seeding {args.rows:,} rows...', file=sys.stderr)
+    seed(object_app, args.rows, random.Random(args.seed))
+    with object_app.app.app_context():
+        object_app.db.engine.dispose()
+    districts = list(object_app.DISTRICT_PRICES)
+
+    results = []
+    for name in SERVERS:
+        proc, port = start_server(name, args.workers, env)
+        try:
+            for concurrency in args.concurrency:
+                for endpoint in ENDPOINTS:
+                    result = run_http(port, proc.pid, endpoint, args.requests, concurrency,
+                                      args.rows, districts, args.seed)
+                    results.append(dict(result, rows=args.rows, mode=name.split('-')[1],
+                                        server=name, concurrency=concurrency, workers=args.workers))
+        finally:
+            proc.terminate()
+            proc.wait()
+
+    for concurrency in args.concurrency:
+        print(f'\nconcurrency {concurrency}, {args.workers} workers')
+        print_table([r for r in results if r['concurrency'] == concurrency])
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'rows': args.rows, 'workers': args.workers, 'results': results}, f, indent=2)
+        print(f'\nResults written to {args.output}')
+
+if __name__ == '__main__':
+    main()
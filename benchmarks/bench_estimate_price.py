@@ -0,0 +1,63 @@
+"""
+Benchmark: scalar estimate_property_price vs vectorized estimate_property_prices.
+
+    python benchmarks/bench_estimate_price.py [rows ...]
+
+Defaults to 1k, 100k and 1M rows. The scalar loop is skipped above 100k rows
+unless --scalar-all is given, its time is extrapolated instead.
+"""
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from object_app import DISTRICT_PRICES, estimate_property_price, estimate_property_prices
+
+SCALAR_MAX_ROWS = 100_000
+
+def make_rows(n, seed=42):
+    rng = random.Random(seed)
+    districts = list(DISTRICT_PRICES) + ['Al Malqa ', 'unknown', None]
+    return {
+        'district': [rng.choice(districts) for _ in range(n)],
+        'area': [float(rng.randint(80, 1500)) for _ in range(n)],
+        'rooms': [rng.randint(0, 8) for _ in range(n)],
+        'bathrooms': [rng.randint(0, 6) for _ in range(n)],
+        'age': [rng.randint(0, 40) for _ in range(n)],
+        'furnished': [rng.choice(('yes', 'no')) for _ in range(n)],
+    }
+
+def run(n, scalar_all=False):
+    cols = make_rows(n)
+
+    start = time.perf_counter()
+    estimated, low, high = estimate_property_prices(
+        cols['district'], cols['area'], cols['rooms'], cols['bathrooms'], cols['age'], cols['furnished']
+    )
+    vector_time = time.perf_counter() - start
+
+    scalar_rows = n if scalar_all else min(n, SCALAR_MAX_ROWS)
+    start = time.perf_counter()
+    scalar = [
+        estimate_property_price(cols['district'][i], cols['area'][i], cols['rooms'][i],
+                                cols['bathrooms'][i], cols['age'][i], cols['furnished'][i])
+        for i in range(scalar_rows)
+    ]
+    scalar_time = (time.perf_counter() - start) * n / scalar_rows
+
+    for i, expected in enumerate(scalar):
+        got = (int(estimated[i]), int(low[i]), int(high[i]))
+        if got != expected:
+            raise AssertionError(f'Row {i}: vectorized {got} != scalar {expected}')
+
+    extrapolated = '' if scalar_rows == n else ' (extrapolated)'
+    print(f'{n:>9,} rows  scalar {scalar_time:8.3f}s{extrapolated}  '
+          f'vectorized {vector_time:8.4f}s  speedup {scalar_time / vector_time:6.1f}x')
+
+if __name__ == '__main__':
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    sizes = [int(a) for a in args] or [1_000, 100_000, 1_000_000]
+    for n in sizes:
+        run(n, scalar_all='--scalar-all' in sys.argv)
@@ -0,0 +1,86 @@
+"""
+Full-inventory export benchmark: Arrow snapshot against the JSON stream.
+
+    python benchmarks/bench_snapshot.py [--rows 100000] [--output results.json]
+
+On one seeded database, reports for each way of extracting every property:
+  json stream    - GET /api/properties?stream=1 through the Flask test client
+  arrow endpoint - GET /api/snapshot/properties.arrow, with and without gzip
+  arrow cli      - flask export-snapshot into a temporary directory
+with elapsed time, bytes produced and the growth in peak RSS, plus the time
+load_snapshot() takes to memory-map the exported file.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_app import ROOT, seed
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def measure(name, run):
+    """Run once, returning elapsed seconds, bytes produced and peak RSS growth"""
+    rss = peak_rss_mb()
+    start = time.perf_counter()
+    size = run()
+    return {'name': name, 'seconds': time.perf_counter() - start, 'bytes': size,
+            'peak_rss_growth_mb': peak_rss_mb() - rss}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='object-bench-snapshot-')
+    os.environ.update(DATABASE_URL=f'sqlite:///{os.path.join(workdir, "bench.db")}', CACHE_BACKEND='none')
+    sys.path.insert(0, ROOT)
+    import object_app
+
+    print(f'Seeding {args.rows:,} rows...', file=sys.stderr)
+    seed(object_app, args.rows, random.Random(args.seed))
+    client = object_app.app.test_client()
+
+    def download(path, **headers):
+        response = client.get(path, headers=headers)
+        return sum(len(chunk) for chunk in response.response)
+
+    def export():
+        result = object_app.app.test_cli_runner().invoke(args=['export-snapshot', workdir, '--table', 'properties'])
+        if result.exit_code:
+            raise RuntimeError(result.output)
+        return os.path.getsize(os.path.join(workdir, 'properties.arrow'))
+
+    # The JSON stream runs last, its dicts would otherwise set the RSS peak for everyone
+    results = [
+        measure('arrow cli', export),
+        measure('arrow endpoint', lambda: download('/api/snapshot/properties.arrow')),
+        measure('arrow endpoint gzip', lambda: download('/api/snapshot/properties.arrow', **{'Accept-Encoding': 'gzip'})),
+        measure('json stream', lambda: download('/api/properties?stream=1')),
+    ]
+    start = time.perf_counter()
+    table = object_app.load_snapshot(os.path.join(workdir, 'properties.arrow'))
+    load_s = time.perf_counter() - start
+
+    print(f'\n{args.rows:,} properties')
+    print(f"{'export':<20} {'seconds':>8} {'MB':>8} {'peak RSS +MB':>13}")
+    for r in results:
+        print(f"{r['name']:<20} {r['seconds']:8.2f} {r['bytes'] / 1e6:8.1f} {r['peak_rss_growth_mb']:13.1f}")
+    print(f'load_snapshot (mmap) {load_s * 1000:.1f} ms for {table.num_rows:,} rows')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'rows': args.rows, 'results': results, 'load_snapshot_s': load_s}, f, indent=2)
+        print(f'\nResults written to {args.output}')
+
+if __name__ == '__main__':
+    main()
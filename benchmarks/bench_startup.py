@@ -0,0 +1,110 @@
+"""
+Cold-start benchmark: how long a fresh process takes before it can serve.
+
+    python benchmarks/bench_startup.py [--runs 5] [--workers 2] [--output results.json]
+
+Reports, as medians over --runs:
+  import        - `import object_app` in a fresh interpreter (also checks that
+                  the import touched neither the database nor the upload folder)
+  gunicorn      - process start to first 200 from gunicorn, with and without
+                  --preload, for --workers workers
+  first request - latency of that first request, which opens the first connection
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import statistics
+import subprocess
+import http.client
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_app import ROOT, free_port, seed
+
+IMPORT_SNIPPET = '''
+import os, sys, time
+start = time.perf_counter()
+import object_app
+elapsed = time.perf_counter() - start
+print(elapsed, os.path.exists(sys.argv[1]), os.path.exists(object_app.UPLOAD_FOLDER))
+'''
+
+def time_import(workdir):
+    """Import object_app against a database path that does not exist yet"""
+    db_path = os.path.join(workdir, 'untouched.db')
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{db_path}', PYTHONPATH=ROOT)
+    out = subprocess.run([sys.executable, '-c', IMPORT_SNIPPET, db_path], env=env, cwd=workdir,
+                         capture_output=True, text=True, check=True).stdout.split()
+    if out[1] == 'True' or out[2] == 'True':
+        raise RuntimeError('Importing object_app created the database or the upload folder')
+    return float(out[0])
+
+def time_gunicorn(workers, preload, env, cwd):
+    """Seconds until the first 200, and that request's latency"""
+    port = free_port()
+    command = [sys.executable, '-m', 'gunicorn', '-w', str(workers), '-b', f'127.0.0.1:{port}',
+               '--chdir', ROOT, '--log-level', 'warning', 'object_app:app']
+    if preload:
+        command.insert(-1, '--preload')
+    start = time.perf_counter()
+    proc = subprocess.Popen(command, env=env, cwd=cwd)
+    try:
+        while time.perf_counter() - start < 30:
+            try:
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+                sent = time.perf_counter()
+                conn.request('GET', '/api/properties?limit=1')
+                response = conn.getresponse()
+                response.read()
+                if response.status == 200:
+                    now = time.perf_counter()
+                    return now - start, now - sent
+            except OSError:
+                time.sleep(0.005)
+        raise RuntimeError('gunicorn did not start')
+    finally:
+        proc.terminate()
+        proc.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='object-bench-startup-')
+    imports = [time_import(workdir) for _ in range(args.runs)]
+
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{os.path.join(workdir, "bench.db")}', CACHE_BACKEND='none')
+    os.environ.update(env)
+    sys.path.insert(0, ROOT)
+    import object_app
+    seed(object_app, args.rows, random.Random(42))
+    with object_app.app.app_context():
+        object_app.db.engine.dispose()
+
+    results = {'import_s': statistics.median(imports)}
+    for preload in (False, True):
+        runs = [time_gunicorn(args.workers, preload, env, workdir) for _ in range(args.runs)]
+        name = 'gunicorn_preload' if preload else 'gunicorn'
+        results[f'{name}_ready_s'] = statistics.median(r[0] for r in runs)
+        results[f'{name}_first_request_s'] = statistics.median(r[1] for r in runs)
+
+    print(f"import object_app            {results['import_s'] * 1000:8.1f} ms")
+    for name in ('gunicorn', 'gunicorn_preload'):
+        print(f"{name:<18} ready       {results[f'{name}_ready_s'] * 1000:8.1f} ms")
+        print(f"{name:<18} 1st request {results[f'{name}_first_request_s'] * 1000:8.1f} ms")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(dict(results, workers=args.workers, runs=args.runs), f, indent=2)
+        print(f'\nResults written to {args.output}')
+
+if __name__ == '__main__':
+    main()
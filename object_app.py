@@ -1,6 +1,41 @@
 import os
-from flask import Flask, render_template, request, redirect, url_for, session, flash
+import io
+import re
+import sys
+import csv
+import json
+import math
+import time
+import zlib
+import atexit
+import pickle
+import sqlite3
+import hashlib
+import secrets
+import tempfile
+import functools
+import threading
+from collections import OrderedDict, Counter
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from types import MappingProxyType
+from urllib.parse import urlencode
+import numpy as np
+from flask import (Flask, render_template, request, redirect, url_for, session, flash, Response,
+                   stream_with_context, make_response, send_from_directory, abort, g,
+                   has_request_context, has_app_context, before_render_template, template_rendered)
+from markupsafe import Markup
+from flask.cli import AppGroup
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin, SecureCookieSessionInterface
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session as FlaskSession
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import SQLAlchemyError
+import click
+from werkzeug.datastructures import CallbackDict
 from werkzeug.utils import secure_filename
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
@@ -8,26 +43,305 @@ from datetime import datetime
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'object_super_secret_key_2026')
 
+def normalize_database_url(url):
+    # Fix for Heroku/Render postgres:// vs postgresql://
+    if url and url.startswith('postgres://'):
+        url = url.replace('postgres://', 'postgresql://', 1)
+    return url
+
+def engine_options(url):
+    """
+    Engine and pool settings for a database URL, tunable from the environment.
+    SQLite gets a busy timeout (WAL is switched on per connection below);
+    server databases get a sized, pre-pinged, recycled pool and a statement timeout.
+    """
+    if url.startswith('sqlite'):
+        return {'connect_args': {'timeout': float(os.environ.get('SQLITE_BUSY_TIMEOUT', 30))}}
+
+    options = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': float(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', '1') in ('1', 'true'),
+    }
+    statement_timeout = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 30000))
+    if url.startswith('postgresql') and statement_timeout:
+        options['connect_args'] = {'options': f'-c statement_timeout={statement_timeout}'}
+    return options
+
 # Database Configuration - Read from environment variable
-database_url = os.environ.get('DATABASE_URL', 'sqlite:///object_database.db')
-# Fix for Heroku/Render postgres:// vs postgresql://
-if database_url.startswith('postgres://'):
-    database_url = database_url.replace('postgres://', 'postgresql://', 1)
+database_url = normalize_database_url(os.environ.get('DATABASE_URL', 'sqlite:///object_database.db'))
+replica_url = normalize_database_url(os.environ.get('DATABASE_REPLICA_URL'))
 
 app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(database_url)
+if replica_url:
+    app.config['SQLALCHEMY_BINDS'] = {'replica': {'url': replica_url, **engine_options(replica_url)}}
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
-db = SQLAlchemy(app)
+class RoutingSession(FlaskSession):
+    """Sends reads to the replica engine inside views marked with @read_replica"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and replica_url and not self._flushing
+                and has_request_context() and g.get('use_replica')):
+            return db.engines['replica']
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
 
-# Upload folder configuration
+@db.event.listens_for(Engine, 'connect')
+def configure_sqlite_connection(dbapi_connection, connection_record):
+    """WAL lets readers run while a worker writes; NORMAL sync is safe with WAL"""
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.close()
+
+def read_replica(view):
+    """Run a read-only view against DATABASE_REPLICA_URL when one is configured"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        g.use_replica = True
+        return view(*args, **kwargs)
+    return wrapper
+
+# Upload folder configuration, created on the first upload
 UPLOAD_FOLDER = os.path.join('static', 'uploads')
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+
+# --- Instrumentation ---
+
+# Opt-in: INSTRUMENTATION=1 adds Server-Timing headers and /_metrics,
+# PROFILE_SLOW_MS additionally samples stacks and dumps the slowest requests.
+INSTRUMENTATION = os.environ.get('INSTRUMENTATION', '0') in ('1', 'true')
+PROFILE_SLOW_MS = float(os.environ.get('PROFILE_SLOW_MS', 0))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+PROFILE_MAX_DUMPS = 20
+N_PLUS_ONE_THRESHOLD = 5  # Same SELECT this many times in one request
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class RequestMetrics:
+    """Timings collected for one request"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = Counter()
+        self.sql_count = 0
+        self.statements = Counter()
+
+    def n_plus_one(self):
+        """SELECT statements repeated often enough to look like lazy loads in a loop"""
+        return [(sql, n) for sql, n in self.statements.items()
+                if n >= N_PLUS_ONE_THRESHOLD and sql.lstrip().upper().startswith('SELECT')]
+
+class MetricsRegistry:
+    """Per-route latency histograms and counters, rendered in Prometheus text format"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = Counter()
+
+    def observe(self, route, method, metrics, duration):
+        labels = (route, method)
+        with self._lock:
+            buckets, total = self._histograms.get(labels, ([0] * len(LATENCY_BUCKETS), [0, 0.0]))
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if duration <= bound:
+                    buckets[i] += 1
+            total[0] += 1
+            total[1] += duration
+            self._histograms[labels] = (buckets, total)
+            self._counters[('object_sql_queries_total', labels)] += metrics.sql_count
+            for phase, seconds in metrics.phases.items():
+                self._counters[(f'object_{phase}_seconds_total', labels)] += seconds
+            self._counters[('object_n_plus_one_total', labels)] += len(metrics.n_plus_one())
+
+    def render(self):
+        def fmt(labels, extra=''):
+            route, method = labels
+            route = route.replace('\\', '\\\\').replace('"', '\\"')
+            return f'{{route="{route}",method="{method}"{extra}}}'
+
+        with self._lock:
+            lines = ['# HELP object_request_duration_seconds Request duration by route',
+                     '# TYPE object_request_duration_seconds histogram']
+            for labels, (buckets, (count, total)) in sorted(self._histograms.items()):
+                for bound, n in zip((*LATENCY_BUCKETS, '+Inf'), (*buckets, count)):
+                    le = f',le="{bound}"'
+                    lines.append(f'object_request_duration_seconds_bucket{fmt(labels, le)} {n}')
+                lines.append(f'object_request_duration_seconds_sum{fmt(labels)} {total}')
+                lines.append(f'object_request_duration_seconds_count{fmt(labels)} {count}')
+            for name in sorted({name for name, _ in self._counters}):
+                lines.append(f'# TYPE {name} counter')
+                for (counter, labels), value in sorted(self._counters.items()):
+                    if counter == name:
+                        lines.append(f'{name}{fmt(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+class SamplingProfiler:
+    """
+    Samples the Python stack of registered request threads every `interval`
+    seconds from one background thread. Results are folded stacks
+    ("outer;inner count"), the input format of flamegraph tools.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self._samples = {}
+        self._lock = threading.Lock()
+        self._active = threading.Event()
+        self._thread = None
+
+    def begin(self, thread_id):
+        with self._lock:
+            self._samples[thread_id] = Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True, name='sampling-profiler')
+                self._thread.start()
+        self._active.set()
+
+    def end(self, thread_id):
+        with self._lock:
+            samples = self._samples.pop(thread_id, Counter())
+            if not self._samples:
+                self._active.clear()
+        return samples
+
+    def _run(self):
+        while True:
+            self._active.wait()
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, samples in self._samples.items():
+                    frame = frames.get(thread_id)
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                        frame = frame.f_back
+                    if stack:
+                        samples[';'.join(reversed(stack))] += 1
+            time.sleep(self.interval)
+
+metrics_registry = MetricsRegistry()
+profiler = SamplingProfiler() if PROFILE_SLOW_MS else None
+_profile_dumps = []  # (duration_ms, path), kept to the PROFILE_MAX_DUMPS slowest
+
+@contextmanager
+def request_phase(name):
+    """Time a block as a named phase of the current request (no-op when disabled)"""
+    metrics = g.get('metrics') if INSTRUMENTATION and has_request_context() else None
+    if metrics is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.phases[name] += time.perf_counter() - start
+
+def dump_profile(route, duration_ms, samples):
+    """Write folded stacks for a slow request, keeping only the slowest dumps on disk"""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    slug = re.sub(r'[^A-Za-z0-9]+', '_', route).strip('_') or 'root'
+    path = os.path.join(PROFILE_DIR, f'{int(time.time())}-{slug}-{int(duration_ms)}ms.folded')
+    with open(path, 'w') as f:
+        for stack, count in samples.most_common():
+            f.write(f'{stack} {count}\n')
+    _profile_dumps.append((duration_ms, path))
+    _profile_dumps.sort(reverse=True)
+    for _, stale in _profile_dumps[PROFILE_MAX_DUMPS:]:
+        try:
+            os.remove(stale)
+        except OSError:
+            pass
+    del _profile_dumps[PROFILE_MAX_DUMPS:]
+
+if INSTRUMENTATION:
+    @app.before_request
+    def start_request_metrics():
+        g.metrics = RequestMetrics()
+        if profiler is not None:
+            profiler.begin(threading.get_ident())
+
+    @app.after_request
+    def finish_request_metrics(response):
+        metrics = g.pop('metrics', None)
+        if metrics is None:
+            return response
+        duration = time.perf_counter() - metrics.start
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics_registry.observe(route, request.method, metrics, duration)
+
+        timings = [f'{name};dur={seconds * 1000:.2f}' for name, seconds in metrics.phases.items()
+                   if name != 'sql']
+        timings.append(f'sql;dur={metrics.phases["sql"] * 1000:.2f};desc="{metrics.sql_count} queries"')
+        timings.append(f'total;dur={duration * 1000:.2f}')
+        response.headers['Server-Timing'] = ', '.join(timings)
+
+        suspects = metrics.n_plus_one()
+        if suspects:
+            response.headers['X-N-Plus-One'] = str(len(suspects))
+            for sql, n in suspects:
+                app.logger.warning('Possible N+1 on %s: %d x %s', route, n, ' '.join(sql.split())[:200])
+
+        if profiler is not None:
+            samples = profiler.end(threading.get_ident())
+            if duration * 1000 >= PROFILE_SLOW_MS and samples:
+                dump_profile(route, duration * 1000, samples)
+        return response
+
+    @app.teardown_request
+    def stop_request_profiler(exc):
+        if profiler is not None:
+            profiler.end(threading.get_ident())
+
+    # The start time lives on the statement's execution context, so a statement
+    # that raises (no after_cursor_execute) leaves nothing behind on the connection
+    @db.event.listens_for(Engine, 'before_cursor_execute')
+    def start_sql_timer(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context.sql_timer_start = time.perf_counter()
+
+    @db.event.listens_for(Engine, 'after_cursor_execute')
+    def stop_sql_timer(conn, cursor, statement, parameters, context, executemany):
+        start = getattr(context, 'sql_timer_start', None)
+        if start is None:
+            return
+        elapsed = time.perf_counter() - start
+        metrics = g.get('metrics') if has_request_context() else None
+        if metrics is not None:
+            metrics.sql_count += 1
+            metrics.phases['sql'] += elapsed
+            metrics.statements[statement] += 1
+
+    @before_render_template.connect_via(app)
+    def start_render_timer(sender, template, context, **extra):
+        if g.get('metrics') is not None:
+            g.render_start = time.perf_counter()
+
+    @template_rendered.connect_via(app)
+    def stop_render_timer(sender, template, context, **extra):
+        metrics = g.get('metrics')
+        if metrics is not None and g.get('render_start') is not None:
+            metrics.phases['render'] += time.perf_counter() - g.pop('render_start')
+
+    @app.route('/_metrics')
+    def metrics_endpoint():
+        """Prometheus scrape endpoint (per worker process)"""
+        return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
 
 # --- SQLAlchemy Models ---
 
 class User(db.Model):
     __tablename__ = 'users'
+    __table_args__ = (
+        db.Index('ix_users_name', 'name'),  # login looks users up by name
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
@@ -37,11 +351,25 @@ class User(db.Model):
 
 class Property(db.Model):
     __tablename__ = 'properties'
+    __table_args__ = (
+        db.Index('ix_properties_district_type_price', 'district_key', 'type', 'price'),
+        db.Index('ix_properties_type_price', 'type', 'price'),
+        db.Index('ix_properties_geo_cell', 'geo_cell'),
+        # Unfiltered /browse sorts (BROWSE_SORTS)
+        db.Index('ix_properties_price_id', 'price', 'id'),
+        db.Index('ix_properties_area_id', 'area', 'id'),
+        db.Index('ix_properties_views_id', 'views', 'id'),
+        db.Index('ix_properties_owner_id', 'owner_id'),
+        db.Index('ix_properties_change_seq', 'change_seq'),
+        # An index rather than unique=True, so flask db upgrade adds it to existing databases
+        db.Index('ix_properties_external_id', 'external_id', unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     price = db.Column(db.Float, nullable=False)
     location = db.Column(db.String(200))
     district = db.Column(db.String(100))
+    district_key = db.Column(db.String(100))  # Normalized district, see normalize_district()
     type = db.Column(db.String(50))
     area = db.Column(db.Float)
     rooms = db.Column(db.Integer)
@@ -51,9 +379,14 @@ class Property(db.Model):
     description = db.Column(db.Text)
     latitude = db.Column(db.Float)
     longitude = db.Column(db.Float)
+    geo_cell = db.Column(db.Integer)  # Fixed grid cell of (latitude, longitude), see geo_cell_for()
     image_path = db.Column(db.String(256))
     views = db.Column(db.Integer, default=0)
     owner_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    external_id = db.Column(db.String(100))  # Partner feed id, used by bulk upserts
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    change_seq = db.Column(db.Integer)  # Sequence of the latest property_changes entry, see record_property_changes()
 
 class Request(db.Model):
     __tablename__ = 'requests'
@@ -63,10 +396,65 @@ class Request(db.Model):
     budget_min = db.Column(db.Float)
     budget_max = db.Column(db.Float)
     district = db.Column(db.String(100))
+    district_key = db.Column(db.String(100))  # Normalized district, see normalize_district()
     type = db.Column(db.String(50))
     notes = db.Column(db.Text)
     date = db.Column(db.DateTime, default=datetime.utcnow)
 
+class RequestMatch(db.Model):
+    """Precomputed lead -> listing matches, maintained by LeadMatcher"""
+    __tablename__ = 'request_matches'
+    request_id = db.Column(db.Integer, db.ForeignKey('requests.id'), primary_key=True)
+    property_id = db.Column(db.Integer, db.ForeignKey('properties.id'), primary_key=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class PropertyChange(db.Model):
+    """Change feed: the latest change per property, deletions included as tombstones"""
+    __tablename__ = 'property_changes'
+    # AUTOINCREMENT so SQLite never hands out a sequence number twice
+    __table_args__ = {'sqlite_autoincrement': True}
+    seq = db.Column(db.Integer, primary_key=True)
+    property_id = db.Column(db.Integer, nullable=False, unique=True)  # No foreign key, tombstones outlive the row
+    deleted = db.Column(db.Boolean, nullable=False, default=False)
+    changed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class MarketStat(db.Model):
+    """Running totals per (district_key, type), maintained by MarketStatsDelta"""
+    __tablename__ = 'market_stats'
+    district_key = db.Column(db.String(100), primary_key=True)  # '' when the listing has none
+    type = db.Column(db.String(50), primary_key=True)
+    listings = db.Column(db.Integer, nullable=False, default=0)
+    price_total = db.Column(db.Float, nullable=False, default=0)
+    sized_listings = db.Column(db.Integer, nullable=False, default=0)  # Listings with an area
+    sized_price_total = db.Column(db.Float, nullable=False, default=0)
+    area_total = db.Column(db.Float, nullable=False, default=0)
+    views = db.Column(db.Integer, nullable=False, default=0)
+
+class MarketPriceBucket(db.Model):
+    """Histogram of price per m² in MARKET_BUCKET_SQM wide buckets, for medians"""
+    __tablename__ = 'market_price_buckets'
+    district_key = db.Column(db.String(100), primary_key=True)
+    type = db.Column(db.String(50), primary_key=True)
+    bucket = db.Column(db.Integer, primary_key=True)
+    listings = db.Column(db.Integer, nullable=False, default=0)
+
+# --- Geo Index ---
+
+# Fixed lat/lng grid (~1.1 km cells). Cells are numbered row by row, so a
+# bounding box maps to one contiguous geo_cell range per grid row.
+GEO_CELL_DEG = 0.01
+GEO_COLS = int(360 / GEO_CELL_DEG)
+
+def geo_row_col(latitude, longitude):
+    return int((latitude + 90) // GEO_CELL_DEG), int((longitude + 180) // GEO_CELL_DEG)
+
+def geo_cell_for(latitude, longitude):
+    """Grid cell for a coordinate, None when the property has no location (forms default to 0, 0)"""
+    if latitude is None or longitude is None or (latitude == 0 and longitude == 0):
+        return None
+    row, col = geo_row_col(latitude, longitude)
+    return row * GEO_COLS + col
+
 # --- Pricing Model ---
 
 # District base prices per square meter (SAR)
@@ -79,6 +467,57 @@ DISTRICT_PRICES = {
     'riyadh': 3500, 'رياض': 3500,
 }
 
+# Canonical district key -> spellings accepted for it (same aliases as DISTRICT_PRICES)
+DISTRICT_ALIASES = {
+    'malqa': ('malqa', 'ملقا', 'al malqa'),
+    'hiteen': ('hiteen', 'حطين', 'al hiteen'),
+    'narjis': ('narjis', 'نرجس', 'al narjis'),
+    'olaya': ('olaya', 'عليا', 'al olaya'),
+    'yasmin': ('yasmin', 'ياسمين', 'al yasmin'),
+    'riyadh': ('riyadh', 'رياض'),
+}
+DISTRICT_KEYS = {alias: key for key, aliases in DISTRICT_ALIASES.items() for alias in aliases}
+
+def normalize_district(district):
+    """
+    Map a free-text district to the key stored in Property.district_key.
+    Known aliases ('Al Malqa', 'الملقا', 'حي الملقا') collapse to one key,
+    anything else is lowercased with whitespace collapsed.
+    """
+    if not district:
+        return None
+    key = ' '.join(district.lower().replace('-', ' ').split())
+    candidates = [key]
+    for prefix in ('حي ', 'district '):
+        if key.startswith(prefix):
+            key = key[len(prefix):]
+            candidates.append(key)
+    for prefix in ('al ', 'ال'):
+        if key.startswith(prefix):
+            candidates.append(key[len(prefix):])
+    for candidate in candidates:
+        if candidate in DISTRICT_KEYS:
+            return DISTRICT_KEYS[candidate]
+    return key
+
+@db.event.listens_for(Property, 'before_insert')
+@db.event.listens_for(Property, 'before_update')
+def set_derived_columns(mapper, connection, target):
+    target.district_key = normalize_district(target.district)
+    target.geo_cell = geo_cell_for(target.latitude, target.longitude)
+
+@db.event.listens_for(Request, 'before_insert')
+@db.event.listens_for(Request, 'before_update')
+def set_request_district_key(mapper, connection, target):
+    target.district_key = normalize_district(target.district)
+
+def derived_columns(values):
+    """The columns set_derived_columns maintains, for bulk writes that bypass the ORM"""
+    return {
+        'district_key': normalize_district(values.get('district')),
+        'geo_cell': geo_cell_for(values.get('latitude'), values.get('longitude')),
+    }
+
 def estimate_property_price(district, area, rooms=0, bathrooms=0, age=0, furnished='no'):
     """
     Smart pricing model using heuristic algorithm.
@@ -86,7 +525,7 @@ def estimate_property_price(district, area, rooms=0, bathrooms=0, age=0, furnish
     """
     # Normalize district name
     district_key = district.lower().strip() if district else 'riyadh'
-    base_price_per_sqm = DISTRICT_PRICES.get(district_key, 3500)
+    base_price_per_sqm = district_base_prices()[0].get(district_key, 3500)
     
     # Base calculation
     base_value = area * base_price_per_sqm
@@ -106,6 +545,296 @@ def estimate_property_price(district, area, rooms=0, bathrooms=0, age=0, furnish
     
     return round(estimated_price), round(low_range), round(high_range)
 
+# DISTRICT_PRICES compiled once into integer codes; code 0 is the 3500 SAR default
+DISTRICT_CODES = {name: code for code, name in enumerate(DISTRICT_PRICES, start=1)}
+DISTRICT_CODE_PRICES = np.array([3500] + list(DISTRICT_PRICES.values()), dtype=np.float64)
+
+def district_codes(districts):
+    """Resolve district names to DISTRICT_CODES, normalizing each distinct name once"""
+    resolved = {}
+    codes = np.empty(len(districts), dtype=np.intp)
+    for i, district in enumerate(districts):
+        code = resolved.get(district)
+        if code is None:
+            key = district.lower().strip() if district else 'riyadh'
+            code = resolved[district] = DISTRICT_CODES.get(key, 0)
+        codes[i] = code
+    return codes
+
+def estimate_property_prices(districts, areas, rooms=None, bathrooms=None, ages=None, furnished=None):
+    """
+    Vectorized estimate_property_price over columns of equal length.
+    Missing columns default like the scalar function (0 / 'no'), and results
+    match it exactly since the same float64 operations run in the same order.
+    Returns: (estimated_prices, low_ranges, high_ranges) as int64 arrays
+    """
+    n = len(districts)
+
+    def column(values, default):
+        if values is None:
+            return np.full(n, default, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float64)
+        if values.shape != (n,):
+            raise ValueError('All columns must have the same length')
+        return values
+
+    base_value = column(areas, 0) * district_base_prices()[1][district_codes(districts)]
+
+    multiplier = np.ones(n)
+    multiplier += column(rooms, 0) * 0.02
+    multiplier += column(bathrooms, 0) * 0.015
+    if furnished is not None:
+        if len(furnished) != n:
+            raise ValueError('All columns must have the same length')
+        multiplier += np.where(np.asarray(furnished, dtype=object) == 'yes', 0.15, 0)
+    multiplier -= column(ages, 0) * 0.005
+
+    estimated = base_value * multiplier
+    low = estimated * 0.9
+    high = estimated * 1.1
+
+    # np.rint rounds half to even, the same as round()
+    return (np.rint(estimated).astype(np.int64),
+            np.rint(low).astype(np.int64),
+            np.rint(high).astype(np.int64))
+
+# --- Market Stats ---
+
+# Aggregates per (district_key, type) are kept up to date as listings are
+# written and views are flushed, so stats never scan the properties table.
+MARKET_BUCKET_SQM = 100  # Price per m² histogram bucket width (SAR); medians are bucket midpoints
+MARKET_COLUMNS = ('district_key', 'type', 'price', 'area', 'views')
+STAT_COLUMNS = ('listings', 'price_total', 'sized_listings', 'sized_price_total', 'area_total', 'views')
+
+# Weight of the observed median price per m² in estimate_property_price (0 keeps DISTRICT_PRICES)
+PRICING_MARKET_WEIGHT = float(os.environ.get('PRICING_MARKET_WEIGHT', 0))
+PRICING_MIN_LISTINGS = int(os.environ.get('PRICING_MIN_LISTINGS', 20))
+PRICING_REFRESH_SECONDS = 300
+
+def market_key(district_key, property_type):
+    return (district_key or '', property_type or '')
+
+def upsert_increments(conn, table, rows):
+    """Insert rows, or add their values onto the existing row with the same primary key"""
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        insert = sqlite_insert
+    keys = [column.name for column in table.primary_key]
+    stmt = insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=keys,
+        set_={name: table.c[name] + stmt.excluded[name] for name in rows[0] if name not in keys}
+    )
+    conn.execute(stmt, rows)
+
+class MarketStatsDelta:
+    """
+    Pending increments to market_stats and market_price_buckets. A listing
+    is added with sign=1 and removed with sign=-1 (an update is both);
+    apply() writes them as `col = col + n` upserts in the caller's transaction,
+    so concurrent writers never overwrite each other's counts.
+    """
+
+    def __init__(self):
+        self.stats = {}
+        self.buckets = Counter()
+
+    def _totals(self, key):
+        return self.stats.setdefault(key, dict.fromkeys(STAT_COLUMNS, 0))
+
+    def add(self, row, sign=1):
+        """row: mapping with the MARKET_COLUMNS of one listing"""
+        key = market_key(row['district_key'], row['type'])
+        totals = self._totals(key)
+        price = row['price'] or 0
+        area = row['area'] or 0
+        totals['listings'] += sign
+        totals['price_total'] += sign * price
+        totals['views'] += sign * (row.get('views') or 0)
+        if area > 0:
+            totals['sized_listings'] += sign
+            totals['sized_price_total'] += sign * price
+            totals['area_total'] += sign * area
+            # Same truncation as the CAST in rebuild_market_stats()
+            self.buckets[key + (int(price / area / MARKET_BUCKET_SQM),)] += sign
+
+    def add_views(self, key, n):
+        self._totals(key)['views'] += n
+
+    def apply(self, conn):
+        stats = [dict(district_key=key[0], type=key[1], **totals)
+                 for key, totals in self.stats.items() if any(totals.values())]
+        buckets = [dict(district_key=key[0], type=key[1], bucket=key[2], listings=n)
+                   for key, n in self.buckets.items() if n]
+        if stats:
+            upsert_increments(conn, MarketStat.__table__, stats)
+        if buckets:
+            upsert_increments(conn, MarketPriceBucket.__table__, buckets)
+
+def listing_values(target, previous=False):
+    """MARKET_COLUMNS of a Property, as last loaded from the database when previous=True"""
+    values = {}
+    state = db.inspect(target)
+    for name in MARKET_COLUMNS:
+        history = state.attrs[name].history
+        values[name] = history.deleted[0] if previous and history.deleted else getattr(target, name)
+    return values
+
+@db.event.listens_for(Property, 'after_insert')
+def count_new_listing(mapper, connection, target):
+    delta = MarketStatsDelta()
+    delta.add(listing_values(target))
+    delta.apply(connection)
+
+@db.event.listens_for(Property, 'after_update')
+def recount_listing(mapper, connection, target):
+    old, new = listing_values(target, previous=True), listing_values(target)
+    if old != new:
+        delta = MarketStatsDelta()
+        delta.add(old, -1)
+        delta.add(new)
+        delta.apply(connection)
+
+@db.event.listens_for(Property, 'after_delete')
+def uncount_listing(mapper, connection, target):
+    delta = MarketStatsDelta()
+    delta.add(listing_values(target, previous=True), -1)
+    delta.apply(connection)
+
+def record_market_views(conn, counts):
+    """Add flushed view counts ({property_id: n}) to market_stats"""
+    delta = MarketStatsDelta()
+    rows = conn.execute(db.select(Property.id, Property.district_key, Property.type)
+                        .where(Property.id.in_(counts)))
+    for row in rows:
+        delta.add_views(market_key(row.district_key, row.type), counts[row.id])
+    delta.apply(conn)
+
+def rebuild_market_stats(conn):
+    """Recompute both aggregate tables from scratch with two GROUP BY queries"""
+    district = db.func.coalesce(Property.district_key, '')
+    property_type = db.func.coalesce(Property.type, '')
+    sized = Property.area > 0
+    conn.execute(db.delete(MarketPriceBucket))
+    conn.execute(db.delete(MarketStat))
+    conn.execute(db.insert(MarketStat).from_select(
+        ['district_key', 'type', *STAT_COLUMNS],
+        db.select(
+            district, property_type,
+            db.func.count(),
+            db.func.coalesce(db.func.sum(Property.price), 0),
+            db.func.count(db.case((sized, 1))),
+            db.func.coalesce(db.func.sum(db.case((sized, Property.price), else_=0)), 0),
+            db.func.coalesce(db.func.sum(db.case((sized, Property.area), else_=0)), 0),
+            db.func.coalesce(db.func.sum(db.func.coalesce(Property.views, 0)), 0),
+        ).group_by(district, property_type)
+    ))
+    per_sqm = Property.price / Property.area / MARKET_BUCKET_SQM
+    bucket = db.cast(db.func.trunc(per_sqm) if db.engine.dialect.name == 'postgresql' else per_sqm, db.Integer)
+    conn.execute(db.insert(MarketPriceBucket).from_select(
+        ['district_key', 'type', 'bucket', 'listings'],
+        db.select(district, property_type, bucket, db.func.count())
+        .where(sized)
+        .group_by(district, property_type, bucket)
+    ))
+
+@app.cli.command('rebuild-stats')
+def rebuild_stats_command():
+    """Recompute the market statistics tables from the properties table."""
+    start = time.perf_counter()
+    with db.engine.begin() as conn:
+        rebuild_market_stats(conn)
+    click.echo(f'Rebuilt market stats in {time.perf_counter() - start:.1f}s')
+
+def bucket_median(histogram):
+    """Midpoint of the bucket holding the median listing of a {bucket: listings} histogram"""
+    total = sum(histogram.values())
+    seen = 0
+    for bucket in sorted(histogram):
+        seen += histogram[bucket]
+        if seen * 2 >= total:
+            return (bucket + 0.5) * MARKET_BUCKET_SQM
+    return None
+
+def market_stats(district_key=None, property_type=None, by_type=False):
+    """
+    Stats per district, or per district and type with by_type, read from the
+    aggregate tables only. Cost depends on the number of districts, types and
+    price buckets, never on the number of listings.
+    """
+    stats_query = db.select(MarketStat).where(MarketStat.listings > 0)
+    buckets_query = db.select(MarketPriceBucket).where(MarketPriceBucket.listings > 0)
+    if district_key is not None:
+        stats_query = stats_query.where(MarketStat.district_key == district_key)
+        buckets_query = buckets_query.where(MarketPriceBucket.district_key == district_key)
+    if property_type is not None:
+        stats_query = stats_query.where(MarketStat.type == property_type)
+        buckets_query = buckets_query.where(MarketPriceBucket.type == property_type)
+
+    def group(row):
+        return (row.district_key, row.type) if by_type else (row.district_key,)
+
+    groups = {}
+    for row in db.session.scalars(stats_query):
+        totals = groups.setdefault(group(row), dict.fromkeys(STAT_COLUMNS, 0))
+        for name in STAT_COLUMNS:
+            totals[name] += getattr(row, name)
+    histograms = {}
+    for row in db.session.scalars(buckets_query):
+        histogram = histograms.setdefault(group(row), Counter())
+        histogram[row.bucket] += row.listings
+
+    results = []
+    for key, totals in sorted(groups.items()):
+        if totals['listings'] <= 0:
+            continue
+        results.append({
+            'district': key[0] or None,
+            'type': (key[1] or None) if by_type else None,
+            'listings': totals['listings'],
+            'avg_price': round(totals['price_total'] / totals['listings']),
+            'sized_listings': totals['sized_listings'],
+            'avg_price_per_sqm': (round(totals['sized_price_total'] / totals['area_total'])
+                                  if totals['area_total'] > 0 else None),
+            'median_price_per_sqm': bucket_median(histograms.get(key, {})),
+            'views': totals['views'],
+        })
+    return results
+
+def market_totals():
+    """Headline counts for the home page"""
+    listings, views, districts = db.session.execute(db.select(
+        db.func.coalesce(db.func.sum(MarketStat.listings), 0),
+        db.func.coalesce(db.func.sum(MarketStat.views), 0),
+        db.func.count(db.distinct(db.case((MarketStat.district_key != '', MarketStat.district_key)))),
+    ).where(MarketStat.listings > 0)).one()
+    return {'properties': listings, 'districts': districts, 'views': views}
+
+market_prices = {}  # Cached district_base_prices() result and its expiry
+
+def district_base_prices():
+    """
+    DISTRICT_PRICES with the observed median price per m² blended in by
+    PRICING_MARKET_WEIGHT, for districts with at least PRICING_MIN_LISTINGS
+    listings that have an area. Refreshed every PRICING_REFRESH_SECONDS.
+    Returns: (prices by DISTRICT_PRICES name, prices by DISTRICT_CODES)
+    """
+    if not PRICING_MARKET_WEIGHT or not has_app_context():
+        return DISTRICT_PRICES, DISTRICT_CODE_PRICES
+    entry = market_prices.get('entry')
+    if entry is None or entry[0] < time.time():
+        observed = {row['district']: row['median_price_per_sqm'] for row in market_stats()
+                    if row['sized_listings'] >= PRICING_MIN_LISTINGS}
+        prices = {}
+        for name, price in DISTRICT_PRICES.items():
+            median = observed.get(DISTRICT_KEYS[name])
+            prices[name] = price if median is None else (
+                (1 - PRICING_MARKET_WEIGHT) * price + PRICING_MARKET_WEIGHT * median)
+        codes = np.array([3500] + list(prices.values()), dtype=np.float64)
+        entry = market_prices['entry'] = (time.time() + PRICING_REFRESH_SECONDS, prices, codes)
+    return entry[1], entry[2]
+
 # --- Translations ---
 TRANSLATIONS = {
     'ar': {
@@ -163,6 +892,20 @@ TRANSLATIONS = {
         'estimating': 'جاري الحساب...',
         'estimated_price': 'السعر المقدر',
         'price_range': 'النطاق السعري',
+
+        # Search
+        'more_filters': 'فلاتر إضافية', 'sort_by': 'ترتيب حسب', 'newest': 'الأحدث',
+        'price_low_high': 'السعر: من الأقل', 'price_high_low': 'السعر: من الأعلى',
+        'largest_area': 'الأكبر مساحة', 'most_viewed': 'الأكثر مشاهدة',
+        'min_area': 'أقل مساحة', 'max_area': 'أكبر مساحة', 'min_rooms': 'أقل عدد غرف',
+        'min_bathrooms': 'أقل عدد حمامات', 'max_age': 'أقصى عمر للعقار',
+        'previous_page': 'السابق', 'next_page': 'التالي', 'page': 'صفحة',
+        'keywords': 'كلمات البحث', 'search_placeholder': 'فيلا مع مسبح، الملقا...', 'relevance': 'الأكثر صلة',
+
+        # Property cards
+        'property': 'عقار', 'location_not_specified': 'الموقع غير محدد',
+        'loading_properties': 'جاري تحميل العقارات...', 'load_error_title': 'تعذر تحميل العقارات',
+        'load_error_desc': 'الخدمة غير متاحة حالياً، يرجى المحاولة لاحقاً.', 'try_again': 'حاول مرة أخرى',
     },
     'en': {
         'title': 'OBJECT', 'dir': 'ltr', 'align': 'left', 'font': 'Inter',
@@ -219,6 +962,20 @@ TRANSLATIONS = {
         'estimating': 'Estimating...',
         'estimated_price': 'Estimated Price',
         'price_range': 'Price Range',
+
+        # Search
+        'more_filters': 'More Filters', 'sort_by': 'Sort By', 'newest': 'Newest',
+        'price_low_high': 'Price: Low to High', 'price_high_low': 'Price: High to Low',
+        'largest_area': 'Largest Area', 'most_viewed': 'Most Viewed',
+        'min_area': 'Min Area', 'max_area': 'Max Area', 'min_rooms': 'Min Rooms',
+        'min_bathrooms': 'Min Bathrooms', 'max_age': 'Max Age',
+        'previous_page': 'Previous', 'next_page': 'Next', 'page': 'Page',
+        'keywords': 'Keywords', 'search_placeholder': 'Villa with pool, Malqa...', 'relevance': 'Most Relevant',
+
+        # Property cards
+        'property': 'Property', 'location_not_specified': 'Location not specified',
+        'loading_properties': 'Loading properties...', 'load_error_title': 'Unable to Load Properties',
+        'load_error_desc': 'The API is currently unavailable. Please try again later.', 'try_again': 'Try Again',
     }
 }
 
@@ -227,39 +984,1484 @@ LANGUAGES = [
     {'code': 'en', 'name': 'English', 'flag': '🇺🇸'}
 ]
 
+# Strings used by client-side renderers, served as /i18n/<lang>.json
+I18N_CLIENT_KEYS = (
+    'rooms', 'bathrooms', 'area', 'price', 'sar', 'villa', 'apartment', 'land', 'property',
+    'location_not_specified', 'no_properties',
+)
+I18N_MAX_AGE = 365 * 24 * 3600  # Bundle URLs carry a content hash
+
+def compile_translations():
+    """
+    Freeze TRANSLATIONS into read-only per-language template contexts (keys
+    missing from a language fall back to Arabic) and compact JSON bundles
+    for the client, each with a hash of its content.
+    Returns: ({lang: context}, {lang: (json_bytes, content_hash)})
+    """
+    contexts, bundles = {}, {}
+    for lang, strings in TRANSLATIONS.items():
+        t = MappingProxyType({**TRANSLATIONS['ar'], **strings})
+        body = json.dumps({key: t[key] for key in I18N_CLIENT_KEYS},
+                          ensure_ascii=False, separators=(',', ':'), sort_keys=True).encode('utf-8')
+        bundles[lang] = (body, hashlib.sha256(body).hexdigest()[:16])
+        contexts[lang] = MappingProxyType(
+            dict(t=t, lang=lang, languages=LANGUAGES, i18n_version=bundles[lang][1]))
+    return contexts, bundles
+
+TRANSLATION_CONTEXTS, I18N_BUNDLES = compile_translations()
+
+def current_language():
+    lang = session.get('lang', 'ar')
+    return lang if lang in TRANSLATION_CONTEXTS else 'ar'
+
 @app.context_processor
 def inject_conf():
-    lang = session.get('lang', 'ar')
-    if lang not in TRANSLATIONS:
-        lang = 'ar'
-    return dict(t=TRANSLATIONS[lang], lang=lang, languages=LANGUAGES)
+    with request_phase('context'):
+        return TRANSLATION_CONTEXTS[current_language()]
+
+layout_fragments = {}  # (name, lang, variant) -> rendered Markup
+
+@app.template_global()
+def layout_fragment(name, **variant):
+    """
+    Render templates/fragments/<name>.html once per language and variant and
+    reuse the markup. Fragments may only depend on the language and on the
+    variant arguments, never on the page or the request.
+    """
+    lang = current_language()
+    key = (name, lang, tuple(sorted(variant.items())))
+    markup = layout_fragments.get(key)
+    if markup is None or app.debug:
+        # Straight from the Jinja environment: render_template() would fire the
+        # render signals again in the middle of the page's own render
+        template = app.jinja_env.get_template(f'fragments/{name}.html')
+        markup = layout_fragments[key] = Markup(template.render(TRANSLATION_CONTEXTS[lang], **variant))
+    return markup
+
+# --- Full-Text Search ---
+
+# Harakat, Quranic annotation marks and tatweel
+ARABIC_DIACRITICS = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]')
+ARABIC_FOLDING = str.maketrans({'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا', 'ى': 'ي', 'ة': 'ه'})
+SEARCH_TOKEN = re.compile(r'\w+')
+SEARCH_COLUMNS = ('title', 'location', 'description')
+SEARCH_BATCH_SIZE = 1000
+
+def fold_text(text):
+    """
+    Normalize text for the search index and for queries alike: lowercase,
+    strip Arabic diacritics and tatweel, fold alef/ya/ta marbuta variants
+    and drop the Arabic article, so 'الْمَلْقَا' and 'ملقا' index the same.
+    English stemming is left to the database tokenizer.
+    """
+    if not text:
+        return ''
+    text = ARABIC_DIACRITICS.sub('', text.lower()).translate(ARABIC_FOLDING)
+    return ' '.join(word[2:] if word.startswith('ال') and len(word) > 4 else word
+                    for word in SEARCH_TOKEN.findall(text))
+
+class SQLiteSearchIndex:
+    """FTS5 table keyed by property id, with the Porter stemmer for English"""
+
+    # Own MetaData, so db.create_all() leaves the table to create()
+    table = db.Table('property_search', db.MetaData(),
+                     db.Column('rowid', db.Integer, primary_key=True),
+                     *[db.Column(name, db.Text) for name in SEARCH_COLUMNS])
+
+    def create(self, conn):
+        conn.execute(db.text(
+            'CREATE VIRTUAL TABLE property_search USING fts5('
+            "title, location, description, tokenize='porter unicode61 remove_diacritics 2')"
+        ))
+        rebuild_search_index(conn)
+
+    def insert(self, conn, rows):
+        conn.execute(db.insert(self.table), [
+            dict(rowid=row['id'], **{name: fold_text(row[name]) for name in SEARCH_COLUMNS})
+            for row in rows
+        ])
+
+    def remove(self, conn, ids):
+        conn.execute(db.delete(self.table).where(self.table.c.rowid.in_(ids)))
+
+    def match(self, query, q):
+        # Joined even without terms, so rank() stays valid on the result
+        query = query.join(self.table, self.table.c.rowid == Property.id)
+        terms = fold_text(q).split()
+        if not terms:
+            return query.filter(db.false())
+        expression = ' '.join(f'"{term}"' for term in terms)
+        return query.filter(db.text('property_search MATCH :search_query').bindparams(search_query=expression))
+
+    def rank(self, q):
+        # bm25 is lower for better matches; title hits count most
+        return db.text('bm25(property_search, 10.0, 5.0, 1.0)')
+
+class PostgresSearchIndex:
+    """Weighted tsvector per property in a side table with a GIN index"""
+
+    table = db.Table('property_search', db.MetaData(),
+                     db.Column('property_id', db.Integer, primary_key=True),
+                     db.Column('document', db.Text))
+
+    def create(self, conn):
+        conn.execute(db.text(
+            'CREATE TABLE property_search (property_id INTEGER PRIMARY KEY '
+            'REFERENCES properties (id) ON DELETE CASCADE, document TSVECTOR NOT NULL)'
+        ))
+        conn.execute(db.text('CREATE INDEX ix_property_search_document ON property_search USING GIN (document)'))
+        rebuild_search_index(conn)
+
+    def insert(self, conn, rows):
+        conn.execute(db.text(
+            'INSERT INTO property_search (property_id, document) VALUES (:id, '
+            "setweight(to_tsvector('english', :title), 'A') || "
+            "setweight(to_tsvector('english', :location), 'B') || "
+            "setweight(to_tsvector('english', :description), 'C'))"
+        ), [dict(id=row['id'], **{name: fold_text(row[name]) for name in SEARCH_COLUMNS}) for row in rows])
+
+    def remove(self, conn, ids):
+        conn.execute(db.delete(self.table).where(self.table.c.property_id.in_(ids)))
+
+    def tsquery(self, q):
+        return db.func.plainto_tsquery('english', fold_text(q))
+
+    def match(self, query, q):
+        query = query.join(self.table, self.table.c.property_id == Property.id)
+        if not fold_text(q):
+            return query.filter(db.false())
+        return query.filter(self.table.c.document.op('@@')(self.tsquery(q)))
+
+    def rank(self, q):
+        return db.func.ts_rank(self.table.c.document, self.tsquery(q)).desc()
+
+def index_properties(conn, rows):
+    """(Re)index rows with id, title, location and description"""
+    if rows:
+        search_index.remove(conn, [row['id'] for row in rows])
+        search_index.insert(conn, rows)
+
+def rebuild_search_index(conn):
+    """Reindex every property in keyset batches"""
+    conn.execute(db.delete(search_index.table))
+    columns = [getattr(Property, name) for name in SEARCH_COLUMNS]
+    cursor = 0
+    while True:
+        rows = conn.execute(db.select(Property.id, *columns).where(Property.id > cursor)
+                            .order_by(Property.id).limit(SEARCH_BATCH_SIZE)).mappings().all()
+        if not rows:
+            break
+        search_index.insert(conn, rows)
+        cursor = rows[-1]['id']
+
+# Picked from the URL rather than the engine, so asgi.py can use it without an app context
+search_index = PostgresSearchIndex() if database_url.startswith('postgresql') else SQLiteSearchIndex()
+
+@db.event.listens_for(Property, 'after_insert')
+def index_new_listing(mapper, connection, target):
+    index_properties(connection, [{'id': target.id, **{name: getattr(target, name) for name in SEARCH_COLUMNS}}])
+
+@db.event.listens_for(Property, 'after_update')
+def reindex_listing(mapper, connection, target):
+    state = db.inspect(target)
+    if any(state.attrs[name].history.has_changes() for name in SEARCH_COLUMNS):
+        index_properties(connection, [{'id': target.id, **{name: getattr(target, name) for name in SEARCH_COLUMNS}}])
+
+@db.event.listens_for(Property, 'after_delete')
+def unindex_listing(mapper, connection, target):
+    search_index.remove(connection, [target.id])
+
+@app.cli.command('reindex-search')
+def reindex_search_command():
+    """Rebuild the full-text search index from the properties table."""
+    start = time.perf_counter()
+    with db.engine.begin() as conn:
+        rebuild_search_index(conn)
+    click.echo(f'Reindexed properties in {time.perf_counter() - start:.1f}s')
+
+# --- Change Feed ---
+
+# Every property write appends to property_changes and drops the property's
+# previous entry, so the log holds one row per property (or tombstone) and
+# `seq > since` is exactly what a mirror is missing.
+CHANGES_MAX_WAIT = 25  # Seconds a long-poll may block (asgi.py only)
+CHANGES_POLL_INTERVAL = float(os.environ.get('CHANGES_POLL_INTERVAL', 1))
+CHANGES_LOCK_KEY = 0x6f626a63  # pg_advisory_xact_lock key serializing change writers
+
+def record_property_changes(conn, property_ids, deleted=False):
+    """
+    Give each property a new sequence number in the caller's transaction and
+    stamp it on properties.change_seq (unless deleted).
+    Returns: {property_id: seq}
+    """
+    property_ids = list(dict.fromkeys(property_ids))
+    if not property_ids:
+        return {}
+    if db.engine.dialect.name == 'postgresql':
+        # Sequence numbers must become visible in order, or a reader could
+        # move past one whose transaction hasn't committed yet. SQLite
+        # serializes writers already.
+        conn.execute(db.text('SELECT pg_advisory_xact_lock(:key)'), {'key': CHANGES_LOCK_KEY})
+    table = PropertyChange.__table__
+    conn.execute(db.delete(table).where(table.c.property_id.in_(property_ids)))
+    now = datetime.utcnow()
+    rows = conn.execute(
+        db.insert(table).returning(table.c.property_id, table.c.seq, sort_by_parameter_order=True),
+        [{'property_id': pid, 'deleted': deleted, 'changed_at': now} for pid in property_ids]
+    ).all()
+    seqs = dict(rows)
+    if not deleted:
+        conn.execute(db.text('UPDATE properties SET change_seq = :seq WHERE id = :id'),
+                     [{'id': pid, 'seq': seq} for pid, seq in seqs.items()])
+    return seqs
+
+def rebuild_property_changes(conn):
+    """Start the feed over with one entry per existing property, in id order"""
+    conn.execute(db.delete(PropertyChange.__table__))
+    cursor = 0
+    while True:
+        ids = conn.scalars(db.select(Property.id).where(Property.id > cursor)
+                           .order_by(Property.id).limit(SEARCH_BATCH_SIZE)).all()
+        if not ids:
+            break
+        record_property_changes(conn, ids)
+        cursor = ids[-1]
+
+@db.event.listens_for(Property, 'after_insert')
+def record_new_listing(mapper, connection, target):
+    seqs = record_property_changes(connection, [target.id])
+    set_committed_value(target, 'change_seq', seqs[target.id])
+
+@db.event.listens_for(Property, 'after_update')
+def record_listing_change(mapper, connection, target):
+    # Also called for dirty objects whose flush changed nothing
+    state = db.inspect(target)
+    if any(state.attrs[attr.key].history.has_changes() for attr in mapper.column_attrs):
+        seqs = record_property_changes(connection, [target.id])
+        set_committed_value(target, 'change_seq', seqs[target.id])
+
+@db.event.listens_for(Property, 'after_delete')
+def record_listing_tombstone(mapper, connection, target):
+    record_property_changes(connection, [target.id], deleted=True)
+
+class ChangeNotifier:
+    """
+    Calls the subscribed callbacks after every commit that changed properties.
+    asgi.py subscribes, so its long-polls and streams wake at once for commits
+    made in their own process; other workers' commits reach them by polling.
+    """
+
+    def __init__(self):
+        self._callbacks = []
+
+    def subscribe(self, callback):
+        self._callbacks.append(callback)
+
+    def notify(self):
+        for callback in self._callbacks:
+            callback()
+
+change_notifier = ChangeNotifier()
+
+# --- Search ---
+
+# Query arg -> (column, operator) for the /browse range filters
+BROWSE_RANGE_FILTERS = {
+    'price_min': ('price', '>='), 'price_max': ('price', '<='),
+    'area_min': ('area', '>='), 'area_max': ('area', '<='),
+    'rooms_min': ('rooms', '>='), 'rooms_max': ('rooms', '<='),
+    'bathrooms_min': ('bathrooms', '>='), 'bathrooms_max': ('bathrooms', '<='),
+    'age_min': ('age', '>='), 'age_max': ('age', '<='),
+}
+
+BROWSE_SORTS = {
+    'newest': (Property.id.desc(),),
+    'price_asc': (Property.price.asc(), Property.id.asc()),
+    'price_desc': (Property.price.desc(), Property.id.desc()),
+    'area_desc': (Property.area.desc(), Property.id.desc()),
+    'views_desc': (Property.views.desc(), Property.id.desc()),
+}
+
+BROWSE_PAGE_SIZE = 24
+
+# Query args carried over to the pager links; anything else (url_for's own
+# keywords like endpoint or _external included) is dropped
+BROWSE_FILTER_ARGS = ('q', 'district', 'type', 'sort', 'per_page', *BROWSE_RANGE_FILTERS)
+
+def browse_filters(args):
+    """The non-empty filter args of a /browse request, without the page number"""
+    return {name: args[name] for name in BROWSE_FILTER_ARGS if args.get(name)}
+
+def browse_order(args):
+    """ORDER BY for the sort arg; 'relevance' (the default with q) ranks text matches"""
+    if args.get('q') and args.get('sort') not in BROWSE_SORTS:
+        return (search_index.rank(args['q']), Property.id.desc())
+    return BROWSE_SORTS.get(args.get('sort'), BROWSE_SORTS['newest'])
+
+def filter_properties(query, args):
+    """Apply the /browse text search, district, type and range filters from request-style args"""
+    if args.get('q'):
+        query = search_index.match(query, args['q'])
+    district_key = normalize_district(args.get('district'))
+    if district_key:
+        query = query.filter(Property.district_key == district_key)
+    if args.get('type'):
+        query = query.filter(Property.type == args.get('type'))
+
+    for arg, (column, op) in BROWSE_RANGE_FILTERS.items():
+        value = args.get(arg)
+        if value in (None, ''):
+            continue
+        column = getattr(Property, column)
+        value = float(value)
+        query = query.filter(column >= value if op == '>=' else column <= value)
+    return query
+
+def search_properties(args, page=1, per_page=BROWSE_PAGE_SIZE):
+    """
+    Filter, sort and page properties from request-style args.
+    Equality filters hit ix_properties_district_type_price, and the page is
+    fetched with LIMIT/OFFSET plus one extra row instead of a COUNT(*).
+    Text searches (q) are ranked by relevance unless another sort is chosen.
+    Returns: (properties, has_next)
+    """
+    query = filter_properties(Property.query, args)
+    order_by = browse_order(args)
+    rows = (query.order_by(*order_by)
+                 .offset((page - 1) * per_page)
+                 .limit(per_page + 1)
+                 .all())
+    return rows[:per_page], len(rows) > per_page
+
+# --- Geo Queries ---
+
+GEO_MAX_CELL_ROWS = 64  # Beyond this many grid rows, scan one cell range instead of one per row
+GEO_POINT_LIMIT = 500
+GEO_CLUSTERS_PER_TILE = 4  # Roughly one cluster per 64px of a 256px map tile
+EARTH_RADIUS_KM = 6371.0
+
+def parse_bbox(raw):
+    """Parse `south,west,north,east` into floats"""
+    south, west, north, east = (float(v) for v in raw.split(','))
+    if south > north or west > east:
+        raise ValueError('bbox must be south,west,north,east')
+    return south, west, north, east
+
+def radius_bbox(latitude, longitude, radius_km):
+    """Bounding box enclosing a circle, used to prefilter radius queries"""
+    dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    dlng = dlat / max(math.cos(math.radians(latitude)), 1e-6)
+    return latitude - dlat, longitude - dlng, latitude + dlat, longitude + dlng
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    dlat = math.radians(lat2 - lat1)
+    dlng = math.radians(lng2 - lng1)
+    a = (math.sin(dlat / 2) ** 2
+         + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlng / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+def filter_bbox(query, south, west, north, east):
+    """Restrict a query to a bounding box using ix_properties_geo_cell, then exact coordinates"""
+    row_min, col_min = geo_row_col(south, west)
+    row_max, col_max = geo_row_col(north, east)
+    if row_max - row_min < GEO_MAX_CELL_ROWS:
+        query = query.filter(db.or_(*[
+            Property.geo_cell.between(row * GEO_COLS + col_min, row * GEO_COLS + col_max)
+            for row in range(row_min, row_max + 1)
+        ]))
+    else:
+        query = query.filter(Property.geo_cell.between(row_min * GEO_COLS + col_min,
+                                                       row_max * GEO_COLS + col_max))
+    return query.filter(Property.latitude.between(south, north),
+                        Property.longitude.between(west, east))
+
+def grid_index(column, origin, size):
+    """SQL expression for floor((column - origin) / size)"""
+    expr = (column - origin) / size
+    if db.engine.dialect.name == 'sqlite':
+        # Values are non-negative inside the bbox, so truncation is floor
+        return db.cast(expr, db.Integer)
+    return db.func.floor(expr)
+
+def cluster_properties(query, south, west, zoom):
+    """
+    Aggregate a bbox-filtered query into map clusters for a zoom level.
+    Grouping happens in SQL, so only one row per cluster leaves the database.
+    """
+    size = 360.0 / (2 ** zoom) / GEO_CLUSTERS_PER_TILE
+    gy = grid_index(Property.latitude, south, size).label('gy')
+    gx = grid_index(Property.longitude, west, size).label('gx')
+    rows = (query.with_entities(
+                gy, gx,
+                db.func.count(Property.id).label('count'),
+                db.func.avg(Property.latitude).label('latitude'),
+                db.func.avg(Property.longitude).label('longitude'),
+                db.func.min(Property.price).label('price_min'),
+                db.func.min(Property.id).label('id'),
+                db.func.min(Property.title).label('title'),
+            )
+            .group_by(gy, gx)
+            .all())
+
+    clusters = []
+    for row in rows:
+        cluster = {'count': row.count, 'latitude': row.latitude, 'longitude': row.longitude,
+                   'price_min': row.price_min}
+        if row.count == 1:
+            # A lone property is sent as a regular marker
+            cluster.update(id=row.id, title=row.title, price=row.price_min)
+        clusters.append(cluster)
+    return clusters
+
+# --- View Counter ---
+
+class ViewCounter:
+    """
+    Write-behind buffer for property view counts.
+    Hits are counted in memory and flushed as batched
+    `UPDATE ... SET views = views + n` statements once `threshold` hits are
+    pending or `interval` seconds have passed. Each worker flushes its own
+    increments, so the stored total stays eventually correct across workers.
+    """
+
+    def __init__(self, interval=10.0, threshold=100):
+        self.interval = interval
+        self.threshold = threshold
+        self._pending = {}
+        self._total = 0
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def record(self, property_id):
+        with self._lock:
+            self._pending[property_id] = self._pending.get(property_id, 0) + 1
+            self._total += 1
+            due = self._total >= self.threshold
+            if self._timer is not None and (not due or self._timer.interval == 0):
+                return
+            if self._timer is not None:
+                self._timer.cancel()
+            # Threshold flushes run on a timer thread too, so a failing
+            # database (hits are kept for the retry) never fails the page view
+            self._timer = threading.Timer(0 if due else self.interval, self._flush_in_context)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def pending(self, property_id):
+        return self._pending.get(property_id, 0)
+
+    def flush(self):
+        """Write pending counts to the database, returns the number of hits flushed"""
+        with self._lock:
+            pending, self._pending, self._total = self._pending, {}, 0
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not pending:
+            return 0
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(
+                    db.text('UPDATE properties SET views = COALESCE(views, 0) + :n WHERE id = :id'),
+                    [{'id': pid, 'n': n} for pid, n in pending.items()]
+                )
+                record_market_views(conn, pending)
+        except Exception:
+            # Put the hits back so the next flush retries them
+            with self._lock:
+                for pid, n in pending.items():
+                    self._pending[pid] = self._pending.get(pid, 0) + n
+                    self._total += n
+            raise
+        return sum(pending.values())
+
+    def _flush_in_context(self):
+        with self._lock:
+            self._timer = None
+        with app.app_context():
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"View counter flush failed: {e}")
+
+view_counter = ViewCounter(
+    interval=float(os.environ.get('VIEW_FLUSH_INTERVAL', 10)),
+    threshold=int(os.environ.get('VIEW_FLUSH_THRESHOLD', 100)),
+)
+atexit.register(view_counter._flush_in_context)
+
+VIEW_DEDUPE_SECONDS = 30 * 60
+VIEW_DEDUPE_MAX_ENTRIES = 50  # Keeps the session cookie small
+
+def should_count_view(property_id):
+    """Count one view per property per session within VIEW_DEDUPE_SECONDS"""
+    now = int(time.time())
+    viewed = {pid: ts for pid, ts in session.get('viewed', {}).items()
+              if now - ts < VIEW_DEDUPE_SECONDS}
+    key = str(property_id)
+    if key in viewed:
+        return False
+    viewed[key] = now
+    # Drop the oldest entries beyond the cap
+    session['viewed'] = dict(sorted(viewed.items(), key=lambda item: item[1])[-VIEW_DEDUPE_MAX_ENTRIES:])
+    return True
+
+# --- Response Cache ---
+
+class MemoryCache:
+    """In-process TTL + LRU cache, private to each worker"""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = time.time()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def version(self):
+        return self._version
+
+    def bump_version(self):
+        with self._lock:
+            self._version = max(time.time(), self._version + 0.001)
+            self._entries.clear()
+
+class SQLiteCache:
+    """
+    TTL + LRU cache in a local SQLite file, shared by every worker on the host.
+    The data version lives in the same file, so an insert handled by one
+    worker invalidates the pages cached by all of them. The file is opened on
+    first use, so a preloading server never hands a connection to its workers.
+    """
+
+    def __init__(self, path, max_entries=1024):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS cache '
+                         '(key TEXT PRIMARY KEY, value BLOB, expires REAL, accessed REAL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_cache_accessed ON cache (accessed)')
+            conn.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value REAL)')
+            conn.execute('INSERT OR IGNORE INTO meta VALUES (?, ?)', ('version', time.time()))
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self._connect()
+        row = conn.execute('SELECT value, expires FROM cache WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if row[1] < now:
+            conn.execute('DELETE FROM cache WHERE key = ?', (key,))
+            return None
+        conn.execute('UPDATE cache SET accessed = ? WHERE key = ?', (now, key))
+        return pickle.loads(row[0])
+
+    def set(self, key, value, ttl):
+        conn = self._connect()
+        now = time.time()
+        conn.execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)',
+                     (key, pickle.dumps(value), now + ttl, now))
+        # Evict expired entries, then the least recently used beyond max_entries
+        conn.execute('DELETE FROM cache WHERE expires < ?', (now,))
+        conn.execute('DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed DESC '
+                     'LIMIT -1 OFFSET ?)', (self.max_entries,))
+
+    def clear(self):
+        self._connect().execute('DELETE FROM cache')
+
+    def version(self):
+        return self._connect().execute("SELECT value FROM meta WHERE name = 'version'").fetchone()[0]
+
+    def bump_version(self):
+        conn = self._connect()
+        conn.execute("UPDATE meta SET value = MAX(?, value + 0.001) WHERE name = 'version'", (time.time(),))
+        conn.execute('DELETE FROM cache')
+
+def build_cache():
+    """Pick the response cache backend from CACHE_BACKEND (memory, sqlite or none)"""
+    backend = os.environ.get('CACHE_BACKEND', 'memory')
+    max_entries = int(os.environ.get('CACHE_MAX_ENTRIES', 1024))
+    if backend == 'none':
+        return None
+    if backend == 'sqlite':
+        return SQLiteCache(os.environ.get('CACHE_PATH', 'object_cache.db'), max_entries=max_entries)
+    return MemoryCache(max_entries=max_entries)
+
+response_cache = build_cache()
+CACHE_TTL = float(os.environ.get('CACHE_TTL', 60))
+
+def cached_response(view):
+    """
+    Cache a GET view's rendered body keyed on path, query args, language,
+    login state and the data version, and answer with ETag/Last-Modified so
+    repeat visitors get 304s. Streamed and non-200 responses pass through.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if response_cache is None or request.method != 'GET':
+            return view(*args, **kwargs)
+
+        version = response_cache.version()
+        key = '|'.join((
+            request.path,
+            urlencode(sorted(request.args.items(multi=True))),
+            session.get('lang', 'ar'),
+            'user' if session.get('user_id') else 'anon',
+            repr(version),
+        ))
+        entry = response_cache.get(key)
+        if entry is None:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200 or response.is_streamed:
+                return response
+            body = response.get_data()
+            entry = (body, response.mimetype, hashlib.sha1(body).hexdigest())
+            response_cache.set(key, entry, CACHE_TTL)
+
+        body, mimetype, etag = entry
+        response = Response(body, mimetype=mimetype)
+        response.set_etag(etag)
+        response.last_modified = datetime.utcfromtimestamp(int(version))
+        response.cache_control.no_cache = True  # Always revalidate, answered with 304 when unchanged
+        response.vary.add('Cookie')
+        return response.make_conditional(request)
+    return wrapper
+
+@db.event.listens_for(db.session, 'after_flush')
+def track_property_changes(session, flush_context):
+    changed = (*session.new, *session.dirty, *session.deleted)
+    if any(isinstance(obj, Property) for obj in changed):
+        session.info['properties_changed'] = True
+    if any(isinstance(obj, User) for obj in changed):
+        session.info['users_changed'] = True
+
+@db.event.listens_for(db.session, 'after_commit')
+def invalidate_response_cache(session):
+    properties_changed = session.info.pop('properties_changed', False)
+    if properties_changed and response_cache is not None:
+        response_cache.bump_version()
+    if properties_changed:
+        change_notifier.notify()
+    # Cached users carry their property ids
+    if session.info.pop('users_changed', False) or properties_changed:
+        user_cache.clear()
+
+@db.event.listens_for(db.session, 'after_rollback')
+def forget_property_changes(session):
+    session.info.pop('properties_changed', None)
+    session.info.pop('users_changed', None)
+
+# --- Sessions ---
+
+SESSION_ID = re.compile(r'[A-Za-z0-9_-]{43}')  # secrets.token_urlsafe(32)
+SESSION_SWEEP_INTERVAL = 600
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """Session data kept in a session store; the cookie only carries the id"""
+
+    def __init__(self, initial=None, sid=None):
+        def on_update(self):
+            self.modified = True
+            self.accessed = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid or secrets.token_urlsafe(32)
+        self.previous_sid = None
+        self.modified = False
+        self.accessed = False
+
+    def __getitem__(self, key):
+        self.accessed = True
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        self.accessed = True
+        return super().get(key, default)
+
+    def setdefault(self, key, default=None):
+        self.accessed = True
+        return super().setdefault(key, default)
+
+    def regenerate(self):
+        """Move the data to a fresh id (on login), so an id planted beforehand stops working"""
+        self.previous_sid = self.previous_sid or self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.modified = True
+
+class SQLiteSessionStore:
+    """Sessions in a local SQLite file shared by every worker on the host"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS sessions (sid TEXT PRIMARY KEY, data TEXT, expires REAL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_sessions_expires ON sessions (expires)')
+            self._local.conn = conn
+        return conn
+
+    def get(self, sid):
+        """(data, expires) of a live session, or None"""
+        return self._connect().execute('SELECT data, expires FROM sessions WHERE sid = ? AND expires > ?',
+                                       (sid, time.time())).fetchone()
+
+    def set(self, sid, data, expires):
+        self._connect().execute('INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)', (sid, data, expires))
+
+    def delete(self, sid):
+        self._connect().execute('DELETE FROM sessions WHERE sid = ?', (sid,))
+
+    def sweep(self):
+        """Delete expired sessions, returns how many"""
+        return self._connect().execute('DELETE FROM sessions WHERE expires <= ?', (time.time(),)).rowcount
+
+class FileSessionStore:
+    """One file per session in `directory`, with the expiry time as its mtime"""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def get(self, sid):
+        path = os.path.join(self.directory, sid)
+        try:
+            expires = os.stat(path).st_mtime
+            if expires <= time.time():
+                return None
+            with open(path, encoding='utf-8') as f:
+                return f.read(), expires
+        except FileNotFoundError:
+            return None
+
+    def set(self, sid, data, expires):
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.', suffix='.part')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.utime(tmp_path, (expires, expires))
+        os.replace(tmp_path, os.path.join(self.directory, sid))
+
+    def delete(self, sid):
+        try:
+            os.remove(os.path.join(self.directory, sid))
+        except FileNotFoundError:
+            pass
+
+    def sweep(self):
+        """Delete expired sessions (and abandoned temp files), returns how many"""
+        if not os.path.isdir(self.directory):
+            return 0
+        now = time.time()
+        removed = 0
+        for entry in os.scandir(self.directory):
+            try:
+                expired = entry.stat().st_mtime <= now
+                if entry.name.endswith('.part'):
+                    expired = entry.stat().st_ctime < now - SESSION_SWEEP_INTERVAL
+                if expired:
+                    os.remove(entry.path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+class ServerSideSessionInterface(SessionInterface):
+    """
+    Keeps session data in a store instead of the signed cookie, so the cookie
+    stays one random id however much the session holds. Sessions expire
+    PERMANENT_SESSION_LIFETIME after their last write; active ones are
+    extended once past half of it. Expired entries are swept every
+    SESSION_SWEEP_INTERVAL seconds per worker, or with flask sweep-sessions.
+    """
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, store):
+        self.store = store
+        self._next_sweep = 0
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid and SESSION_ID.fullmatch(sid):
+            entry = self.store.get(sid)
+            if entry is not None:
+                data, expires = entry
+                session = ServerSideSession(self.serializer.loads(data), sid=sid)
+                if expires - time.time() < app.permanent_session_lifetime.total_seconds() / 2:
+                    session.modified = True
+                return session
+        return ServerSideSession()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.previous_sid:
+            self.store.delete(session.previous_sid)
+
+        if not session:
+            if session.modified:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path, secure=self.get_cookie_secure(app),
+                                       samesite=self.get_cookie_samesite(app),
+                                       httponly=self.get_cookie_httponly(app))
+            return
+        if session.accessed:
+            response.vary.add('Cookie')
+        if not self.should_set_cookie(app, session):
+            return
+
+        now = time.time()
+        self.store.set(session.sid, self.serializer.dumps(dict(session)),
+                       now + app.permanent_session_lifetime.total_seconds())
+        response.set_cookie(name, session.sid, expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app), domain=domain, path=path,
+                            secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app))
+        if now >= self._next_sweep:
+            self._next_sweep = now + SESSION_SWEEP_INTERVAL
+            self.store.sweep()
+
+def build_session_interface():
+    """Pick where sessions live from SESSION_BACKEND (cookie, sqlite or file)"""
+    backend = os.environ.get('SESSION_BACKEND', 'cookie')
+    if backend == 'sqlite':
+        return ServerSideSessionInterface(SQLiteSessionStore(os.environ.get('SESSION_PATH', 'object_sessions.db')))
+    if backend == 'file':
+        return ServerSideSessionInterface(FileSessionStore(os.environ.get('SESSION_DIR', 'sessions')))
+    return SecureCookieSessionInterface()
+
+app.session_interface = build_session_interface()
+
+def regenerate_session():
+    """New session id after login; signed cookies carry no id, so only the server-side store needs this"""
+    if isinstance(session, ServerSideSession):
+        session.regenerate()
+
+@app.cli.command('sweep-sessions')
+def sweep_sessions_command():
+    """Delete expired server-side sessions."""
+    if not isinstance(app.session_interface, ServerSideSessionInterface):
+        raise click.ClickException('SESSION_BACKEND is cookie, there is nothing to sweep.')
+    click.echo(f'Removed {app.session_interface.store.sweep()} expired sessions')
+
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', 30))
+user_cache = MemoryCache(max_entries=4096)
+
+def current_user():
+    """
+    The logged-in user as a dict with their property ids, or None. Cached for
+    USER_CACHE_TTL seconds; commits that touch users or properties clear this
+    worker's cache, other workers catch up within the TTL.
+    """
+    user_id = session.get('user_id')
+    if user_id is None:
+        return None
+    if 'current_user' not in g:
+        user = user_cache.get(user_id)
+        if user is None:
+            row = db.session.get(User, user_id)
+            if row is not None:
+                user = {
+                    'id': row.id, 'name': row.name, 'email': row.email, 'role': row.role,
+                    'property_ids': db.session.scalars(db.select(Property.id)
+                                                       .where(Property.owner_id == row.id)
+                                                       .order_by(Property.id)).all(),
+                }
+                user_cache.set(user_id, user, USER_CACHE_TTL)
+        g.current_user = user
+    return g.current_user
+
+# --- Bulk Import ---
+
+IMPORT_CHUNK_SIZE = 1000
+IMPORT_CHUNK_SIZE_MAX = 10000
+IMPORT_MAX_REPORTED_ERRORS = 1000
+
+def property_values(data):
+    """Column values for a new property, with the same coercions as /api/add_property"""
+    if not data.get('title') or not data.get('price'):
+        raise ValueError('Missing required fields: title and price are required')
+    owner_id = data.get('owner_id', 1)
+    if isinstance(owner_id, str):
+        # CSV cells are always strings
+        owner_id = int(owner_id) if owner_id.strip() else 1
+    return dict(
+        title=data.get('title'),
+        price=float(data.get('price')),
+        location=data.get('location'),
+        district=data.get('district'),
+        type=data.get('type', 'villa'),
+        area=float(data.get('area', 0) or 0),
+        rooms=int(data.get('rooms', 0) or 0),
+        bathrooms=int(data.get('bathrooms', 0) or 0),
+        age=int(data.get('age', 0) or 0),
+        furnished=data.get('furnished', 'no'),
+        description=data.get('description'),
+        latitude=float(data.get('latitude', 0) or 0),
+        longitude=float(data.get('longitude', 0) or 0),
+        image_path=data.get('image_path'),
+        owner_id=owner_id,
+        external_id=data.get('external_id') or None
+    )
+
+def read_import_rows(stream, fmt='jsonl'):
+    """Yield (row_number, dict) from a JSON Lines or CSV byte stream, or (row_number, error)"""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if fmt == 'csv':
+        # Row numbers count the header line, so they match the file
+        for number, row in enumerate(csv.DictReader(text), start=2):
+            yield number, row
+        return
+    for number, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+            if not isinstance(row, dict):
+                raise ValueError('Expected a JSON object')
+        except ValueError as e:
+            row = e
+        yield number, row
+
+def write_property_rows(rows, upsert=False):
+    """
+    Write one chunk with executemany inserts (and bulk updates by primary key
+    for external ids that already exist when upserting).
+    Returns: (inserted_ids, updated_ids)
+    """
+    inserts, updates = rows, []
+    if upsert:
+        external_ids = [r['external_id'] for r in rows if r['external_id']]
+        existing = dict(db.session.query(Property.external_id, Property.id)
+                        .filter(Property.external_id.in_(external_ids))) if external_ids else {}
+        inserts = [r for r in rows if r['external_id'] not in existing]
+        updates = [dict(r, id=existing[r['external_id']]) for r in rows if r['external_id'] in existing]
+    delta = MarketStatsDelta()
+    inserted_ids = []
+    if inserts:
+        inserted_ids = db.session.scalars(
+            db.insert(Property).returning(Property.id, sort_by_parameter_order=True), inserts).all()
+        for r in inserts:
+            delta.add(r)
+    if updates:
+        columns = [getattr(Property, name) for name in MARKET_COLUMNS]
+        previous = {row.id: row._mapping for row in db.session.execute(
+            db.select(Property.id, *columns).where(Property.id.in_([r['id'] for r in updates])))}
+        db.session.execute(db.update(Property), updates)
+        for r in updates:
+            old = previous[r['id']]
+            delta.add(old, -1)
+            delta.add(dict(r, views=old['views']))
+    # Core bulk writes skip the mapper events that maintain market stats, the search index and the change feed
+    delta.apply(db.session)
+    index_properties(db.session, [dict(r, id=i) for r, i in zip(inserts, inserted_ids)] + updates)
+    record_property_changes(db.session, inserted_ids + [r['id'] for r in updates])
+    return inserted_ids, [r['id'] for r in updates]
+
+def import_properties(rows, chunk_size=IMPORT_CHUNK_SIZE, upsert=False):
+    """
+    Validate and insert (row_number, dict) pairs in chunks, committing each chunk.
+    Invalid rows are reported and skipped; if a chunk fails in the database,
+    its rows are retried one by one so only the offending rows are rejected.
+    """
+    result = {'inserted': 0, 'updated': 0, 'error_count': 0, 'errors': []}
+
+    def reject(number, error):
+        result['error_count'] += 1
+        if len(result['errors']) < IMPORT_MAX_REPORTED_ERRORS:
+            result['errors'].append({'row': number, 'error': str(error)})
+
+    def flush(chunk):
+        if not chunk:
+            return
+        values = [v for _, v in chunk]
+        try:
+            with db.session.begin_nested():
+                inserted, updated = write_property_rows(values, upsert)
+        except SQLAlchemyError:
+            inserted, updated = [], []
+            for number, value in chunk:
+                try:
+                    with db.session.begin_nested():
+                        i, u = write_property_rows([value], upsert)
+                    inserted += i
+                    updated += u
+                except SQLAlchemyError as e:
+                    reject(number, getattr(e, 'orig', None) or e)
+        # Core bulk writes skip the ORM flush events, so flag the cache invalidation here
+        db.session.info['properties_changed'] = True
+        db.session.commit()
+        result['inserted'] += len(inserted)
+        result['updated'] += len(updated)
+        match_new_properties(inserted + updated)
+
+    chunk = []
+    chunk_ids = set()
+    for number, data in rows:
+        try:
+            if isinstance(data, Exception):
+                raise data
+            values = property_values(data)
+        except (ValueError, TypeError) as e:
+            reject(number, e)
+            continue
+        values.update(derived_columns(values))
+        # An external id repeated within a chunk must see its earlier row written first
+        if values['external_id'] in chunk_ids or len(chunk) >= chunk_size:
+            flush(chunk)
+            chunk, chunk_ids = [], set()
+        chunk.append((number, values))
+        if values['external_id']:
+            chunk_ids.add(values['external_id'])
+    flush(chunk)
+    return result
+
+IMPORT_FORMATS = {'text/csv': 'csv', 'application/x-ndjson': 'jsonl', 'application/jsonl': 'jsonl'}
+
+@app.cli.command('import-properties')
+@click.argument('source', type=click.File('rb'))
+@click.option('--format', 'fmt', type=click.Choice(['jsonl', 'csv']), default=None,
+              help='Input format, guessed from the file extension by default.')
+@click.option('--chunk-size', default=IMPORT_CHUNK_SIZE, show_default=True)
+@click.option('--upsert', is_flag=True, help='Update properties whose external_id already exists.')
+def import_properties_command(source, fmt, chunk_size, upsert):
+    """Import properties from a JSON Lines or CSV file (- for stdin)."""
+    fmt = fmt or ('csv' if source.name.endswith('.csv') else 'jsonl')
+    start = time.perf_counter()
+    result = import_properties(read_import_rows(source, fmt), chunk_size=chunk_size, upsert=upsert)
+    for error in result['errors']:
+        click.echo(f"row {error['row']}: {error['error']}", err=True)
+    click.echo(f"Inserted {result['inserted']}, updated {result['updated']}, "
+               f"rejected {result['error_count']} in {time.perf_counter() - start:.1f}s")
+
+# --- Snapshots ---
+
+# Whole-table exports as Arrow IPC files (pyarrow, imported on first use).
+# Rows are read with Core selects in keyset batches, so memory stays at one
+# batch whatever the table size, and the file format lets consumers
+# memory-map a download instead of parsing it (see load_snapshot()).
+SNAPSHOT_TABLES = ('properties', 'requests')
+SNAPSHOT_BATCH_SIZE = 10_000
+SNAPSHOT_GZIP_LEVEL = 1  # Columnar buffers compress well already at the fastest level
+SNAPSHOT_MEDIA_TYPE = 'application/vnd.apache.arrow.file'
+
+def snapshot_schema(table):
+    """Arrow schema for a table's columns (Text is a String)"""
+    import pyarrow as pa
+    types = ((db.Boolean, pa.bool_()), (db.Integer, pa.int64()), (db.Float, pa.float64()),
+             (db.DateTime, pa.timestamp('us')), (db.String, pa.string()))
+    return pa.schema([
+        pa.field(column.name, next(t for base, t in types if isinstance(column.type, base)),
+                 nullable=not column.primary_key)
+        for column in table.columns
+    ])
+
+@contextmanager
+def snapshot_connection():
+    """Connection whose reads all see one consistent snapshot of the database"""
+    with db.engine.connect() as conn:
+        if conn.dialect.name == 'postgresql':
+            conn = conn.execution_options(isolation_level='REPEATABLE READ', postgresql_readonly=True)
+        with conn.begin():
+            if conn.dialect.name == 'sqlite':
+                # pysqlite doesn't begin a transaction for SELECTs by itself
+                conn.exec_driver_sql('BEGIN')
+            yield conn
+
+def write_snapshot(conn, name, sink, batch_size=SNAPSHOT_BATCH_SIZE):
+    """
+    Write the `name` table to `sink` (a writable binary file) as an Arrow IPC
+    file, yielding the number of rows written after every record batch so the
+    caller can drain the sink. The footer is written when the generator ends.
+    """
+    import pyarrow as pa
+    table = db.metadata.tables[name]
+    metadata = {'table': name, 'exported_at': datetime.utcnow().isoformat()}
+    if name == 'properties':
+        # Mirrors can load the snapshot, then follow /api/properties/changes from here
+        metadata['change_seq'] = str(conn.scalar(db.select(db.func.max(PropertyChange.seq))) or 0)
+    schema = snapshot_schema(table).with_metadata(metadata)
+    key = list(table.c).index(table.c.id)
+    rows = 0
+    cursor = None
+    with pa.ipc.new_file(sink, schema) as writer:
+        while True:
+            query = db.select(table).order_by(table.c.id).limit(batch_size)
+            if cursor is not None:
+                query = query.where(table.c.id > cursor)
+            batch = conn.execute(query).all()
+            if not batch:
+                break
+            writer.write_batch(pa.record_batch(
+                [pa.array(values, type=field.type) for values, field in zip(zip(*batch), schema)],
+                schema=schema))
+            rows += len(batch)
+            cursor = batch[-1][key]
+            yield rows
+
+def load_snapshot(path):
+    """
+    Memory-map an exported snapshot as a pyarrow.Table. Nothing is copied or
+    parsed up front, pages are read as columns are touched; the table's
+    schema.metadata carries the source table, export time and change_seq.
+    """
+    import pyarrow as pa
+    return pa.ipc.open_file(pa.memory_map(path)).read_all()
+
+@app.cli.command('export-snapshot')
+@click.argument('directory', type=click.Path(file_okay=False))
+@click.option('--table', 'tables', multiple=True, type=click.Choice(SNAPSHOT_TABLES),
+              help='Table to export, repeatable. All of them by default.')
+@click.option('--batch-size', default=SNAPSHOT_BATCH_SIZE, show_default=True)
+def export_snapshot_command(directory, tables, batch_size):
+    """Write Arrow IPC snapshots (<table>.arrow) of the inventory tables to DIRECTORY."""
+    os.makedirs(directory, exist_ok=True)
+    start = time.perf_counter()
+    # One snapshot for every table, so the files agree with each other
+    with snapshot_connection() as conn:
+        for name in tables or SNAPSHOT_TABLES:
+            path = os.path.join(directory, f'{name}.arrow')
+            rows = 0
+            with open(path + '.tmp', 'wb') as f:
+                for rows in write_snapshot(conn, name, f, batch_size):
+                    pass
+            os.replace(path + '.tmp', path)
+            click.echo(f'{name}: {rows} rows, {os.path.getsize(path) / 1e6:.1f} MB')
+    click.echo(f'Exported in {time.perf_counter() - start:.1f}s')
+
+# --- Lead Matching ---
+
+class IntervalIndex:
+    """
+    Stabbing queries ("which intervals contain x?") over closed intervals.
+    A centered interval tree answers in O(log n + k); new intervals go to a
+    small unsorted buffer that is merged into the tree once it outgrows sqrt(n).
+    """
+
+    def __init__(self):
+        self._intervals = []
+        self._pending = []
+        self._root = None
+
+    def __len__(self):
+        return len(self._intervals) + len(self._pending)
+
+    def add(self, start, end, value):
+        self._pending.append((start, end, value))
+        if len(self._pending) > max(32, math.isqrt(len(self._intervals))):
+            self._intervals.extend(self._pending)
+            self._pending = []
+            self._root = self._build(self._intervals)
+
+    @classmethod
+    def _build(cls, intervals):
+        if not intervals:
+            return None
+        center = sorted(start for start, _, _ in intervals)[len(intervals) // 2]
+        here, left, right = [], [], []
+        for interval in intervals:
+            if interval[1] < center:
+                left.append(interval)
+            elif interval[0] > center:
+                right.append(interval)
+            else:
+                here.append(interval)
+        if len(left) == len(intervals):
+            # Only inverted intervals (end < start) can all fall left of a start;
+            # keep them here rather than partitioning them forever
+            here, left = left, []
+        return (center,
+                sorted(here, key=lambda i: i[0]),
+                sorted(here, key=lambda i: i[1], reverse=True),
+                cls._build(left),
+                cls._build(right))
+
+    def stab(self, point):
+        """Yield the values of every interval with start <= point <= end"""
+        node = self._root
+        while node is not None:
+            center, by_start, by_end, left, right = node
+            if point < center:
+                for start, _, value in by_start:
+                    if start > point:
+                        break
+                    yield value
+                node = left
+            else:
+                for _, end, value in by_end:
+                    if end < point:
+                        break
+                    yield value
+                node = right if point > center else None
+        for start, end, value in self._pending:
+            if start <= point <= end:
+                yield value
+
+MATCHES_PER_REQUEST = 500  # Cap on listings stored for a broad request
+
+def budget_interval(budget_min, budget_max):
+    """
+    A request's budget as a closed interval, 0 / empty max meaning no upper
+    bound. Bounds entered the wrong way round are swapped.
+    """
+    low, high = budget_min or 0, budget_max if budget_max else math.inf
+    return (high, low) if high < low else (low, high)
+
+class LeadMatcher:
+    """
+    In-memory index of buyer requests bucketed by (district_key, type), with
+    an IntervalIndex over the budget in each bucket. An empty district or type
+    on a request matches any value. Each worker loads only requests newer than
+    the last one it has seen, so requests added by other workers are picked up
+    incrementally, once per batch of lookups.
+    """
+
+    def __init__(self):
+        self._buckets = {}
+        self._last_request_id = 0
+        self._lock = threading.Lock()
+
+    def _add(self, request_id, district_key, type, budget_min, budget_max):
+        bucket = self._buckets.setdefault((district_key or None, type or None), IntervalIndex())
+        bucket.add(*budget_interval(budget_min, budget_max), request_id)
+        self._last_request_id = max(self._last_request_id, request_id)
+
+    def refresh(self):
+        """Index requests created since the last refresh"""
+        rows = (db.session.query(Request.id, Request.district_key, Request.type,
+                                 Request.budget_min, Request.budget_max)
+                .filter(Request.id > self._last_request_id)
+                .order_by(Request.id)
+                .all())
+        with self._lock:
+            for row in rows:
+                if row.id > self._last_request_id:
+                    self._add(*row)
+
+    def requests_for(self, district_key, type, price):
+        """Ids of indexed requests a listing matches; call refresh() first to pick up new requests"""
+        matches = set()
+        with self._lock:
+            for key in {(district_key, type), (district_key, None), (None, type), (None, None)}:
+                bucket = self._buckets.get(key)
+                if bucket is not None:
+                    matches.update(bucket.stab(price))
+        return matches
+
+def request_match_filter(query, lead):
+    """Filter a Property query down to the listings matching a request"""
+    low, high = budget_interval(lead.budget_min, lead.budget_max)
+    if lead.district_key:
+        query = query.filter(Property.district_key == lead.district_key)
+    if lead.type:
+        query = query.filter(Property.type == lead.type)
+    query = query.filter(Property.price >= low)
+    if high != math.inf:
+        query = query.filter(Property.price <= high)
+    return query
+
+lead_matcher = LeadMatcher()
+
+def save_matches(pairs):
+    """Insert (request_id, property_id) pairs, skipping ones already stored"""
+    pairs = set(pairs)
+    if not pairs:
+        return
+    request_ids = {r for r, _ in pairs}
+    property_ids = {p for _, p in pairs}
+    existing = set(db.session.query(RequestMatch.request_id, RequestMatch.property_id)
+                   .filter(RequestMatch.request_id.in_(request_ids),
+                           RequestMatch.property_id.in_(property_ids)))
+    new = [{'request_id': r, 'property_id': p} for r, p in pairs - existing]
+    if new:
+        db.session.execute(db.insert(RequestMatch), new)
+    db.session.commit()
+
+def match_new_properties(property_ids):
+    """Record which open requests newly added or changed listings satisfy"""
+    if not property_ids:
+        return
+    try:
+        lead_matcher.refresh()
+        rows = (db.session.query(Property.id, Property.district_key, Property.type, Property.price)
+                .filter(Property.id.in_(property_ids)))
+        save_matches((request_id, row.id) for row in rows
+                     for request_id in lead_matcher.requests_for(row.district_key, row.type, row.price))
+    except Exception as e:
+        # Runs after the listing is committed, so it must never fail the request
+        db.session.rollback()
+        print(f"Lead matching failed for properties {list(property_ids)[:10]}: {e}")
+
+def match_new_request(lead):
+    """Record the existing listings a new request matches, newest first"""
+    try:
+        # Index the new request now, so the next listing lookup doesn't have to
+        lead_matcher.refresh()
+        property_ids = (request_match_filter(db.session.query(Property.id), lead)
+                        .order_by(Property.id.desc())
+                        .limit(MATCHES_PER_REQUEST)
+                        .all())
+        save_matches((lead.id, row.id) for row in property_ids)
+    except Exception as e:
+        # Runs after the request is committed, so it must never fail the request
+        db.session.rollback()
+        print(f"Lead matching failed for request {lead.id}: {e}")
+
+# --- Images ---
+
+# Variant name -> bounding box; originals are kept as uploaded
+IMAGE_SIZES = {
+    'card': (600, 400),
+    'detail': (1600, 1200),
+}
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.gif'}
+IMAGE_MAX_AGE = 365 * 24 * 3600  # Content-addressed files never change
+IMAGE_FALLBACK_MAX_AGE = 300
+
+image_pool = ThreadPoolExecutor(max_workers=int(os.environ.get('IMAGE_WORKERS', 2)),
+                                thread_name_prefix='images')
+
+def is_content_addressed(filename):
+    stem = os.path.splitext(filename)[0]
+    return len(stem) == 64 and all(c in '0123456789abcdef' for c in stem)
+
+def variant_filenames(filename, size):
+    """Candidate variant names for an upload, preferred format first"""
+    stem = os.path.splitext(filename)[0]
+    return [f'{stem}.{size}.webp', f'{stem}.{size}.jpg']
+
+def store_upload(file):
+    """
+    Save an uploaded image under the SHA-256 of its content and queue its
+    thumbnails on the image pool. Identical uploads share one file.
+    Returns the stored filename (the value for Property.image_path).
+    """
+    ext = os.path.splitext(secure_filename(file.filename))[1].lower()
+    if ext not in IMAGE_EXTENSIONS:
+        raise ValueError(f'Unsupported image type: {ext or file.filename}')
+
+    digest = hashlib.sha256()
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=app.config['UPLOAD_FOLDER'], suffix='.part')
+    with os.fdopen(fd, 'wb') as out:
+        for chunk in iter(lambda: file.stream.read(64 * 1024), b''):
+            digest.update(chunk)
+            out.write(chunk)
+
+    filename = digest.hexdigest() + ('.jpg' if ext == '.jpeg' else ext)
+    path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    if os.path.exists(path):
+        os.remove(tmp_path)
+    else:
+        os.replace(tmp_path, path)
+    image_pool.submit(build_image_variants, filename)
+    return filename
+
+def build_image_variants(filename):
+    """Write the card/detail thumbnails for an upload, skipping ones that already exist"""
+    from PIL import Image, ImageOps  # Only image workers pay for importing Pillow
+    folder = app.config['UPLOAD_FOLDER']
+    try:
+        with Image.open(os.path.join(folder, filename)) as original:
+            image = ImageOps.exif_transpose(original)
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+            for size, box in IMAGE_SIZES.items():
+                if any(os.path.exists(os.path.join(folder, n)) for n in variant_filenames(filename, size)):
+                    continue
+                thumbnail = image.copy()
+                thumbnail.thumbnail(box, Image.LANCZOS)
+                webp_name, jpeg_name = variant_filenames(filename, size)
+                # Write to a temp name and rename, so a half-written file is never served
+                tmp_path = os.path.join(folder, webp_name + '.part')
+                try:
+                    thumbnail.save(tmp_path, 'WEBP', quality=80, method=4)
+                    os.replace(tmp_path, os.path.join(folder, webp_name))
+                except (OSError, KeyError):
+                    # Pillow built without WebP support
+                    tmp_path = os.path.join(folder, jpeg_name + '.part')
+                    thumbnail.convert('RGB').save(tmp_path, 'JPEG', quality=82, optimize=True, progressive=True)
+                    os.replace(tmp_path, os.path.join(folder, jpeg_name))
+    except Exception as e:
+        print(f"Image processing failed for {filename}: {e}")
+
+@app.cli.command('build-thumbnails')
+def build_thumbnails_command():
+    """Generate missing thumbnails for every property image."""
+    filenames = [row[0] for row in db.session.query(Property.image_path)
+                 .filter(Property.image_path.isnot(None)).distinct()]
+    for filename in filenames:
+        build_image_variants(filename)
+    click.echo(f'Processed {len(filenames)} images')
 
 # --- Routes ---
 
 @app.route('/')
+@cached_response
 def home():
-    return render_template('home.html')
+    return render_template('home.html', stats=market_totals())
 
 @app.route('/browse')
+@cached_response
+@read_replica
 def browse():
-    query = Property.query
-    
-    if request.args.get('district'):
-        query = query.filter(Property.district.ilike(f"%{request.args.get('district')}%"))
-    if request.args.get('type'):
-        query = query.filter(Property.type == request.args.get('type'))
-    if request.args.get('price_max'):
-        query = query.filter(Property.price <= float(request.args.get('price_max')))
-    
-    properties = query.all()
-    return render_template('browse.html', properties=properties)
+    page = max(1, request.args.get('page', 1, type=int))
+    # Malformed values fall back to the default, like `page`
+    per_page = parse_page_size(request.args.get('per_page', type=int), default=BROWSE_PAGE_SIZE)
+    try:
+        properties, has_next = search_properties(request.args, page=page, per_page=per_page)
+    except ValueError:
+        flash('Invalid search filter')
+        properties, has_next = [], False
+
+    # Current filters, reused by the pager links
+    filters = browse_filters(request.args)
+    return render_template('browse.html', properties=properties, page=page,
+                           has_next=has_next, filters=filters)
 
 @app.route('/property/<int:id>')
+@read_replica
 def property_details(id):
     prop = Property.query.get_or_404(id)
-    prop.views = (prop.views or 0) + 1
-    db.session.commit()
-    return render_template('details.html', p=prop)
+    if should_count_view(prop.id):
+        view_counter.record(prop.id)
+    return render_template('details.html', p=prop, pending_views=view_counter.pending(prop.id))
 
 @app.route('/dashboard', methods=['GET', 'POST'])
 def dashboard():
@@ -268,8 +2470,7 @@ def dashboard():
             file = request.files.get('image')
             filename = None
             if file and file.filename:
-                filename = secure_filename(file.filename)
-                file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+                filename = store_upload(file)
             
             new_property = Property(
                 title=request.form['title'],
@@ -290,6 +2491,7 @@ def dashboard():
             )
             db.session.add(new_property)
             db.session.commit()
+            match_new_properties([new_property.id])
             flash('Property added successfully!', 'success')
             return redirect(url_for('dashboard'))
         except Exception as e:
@@ -305,23 +2507,27 @@ def dashboard():
             flash(f'Error adding property: {str(e)}', 'error')
             return redirect(url_for('dashboard'))
     
-    properties = Property.query.all()
-    return render_template('dashboard.html', properties=properties)
+    return render_template('dashboard.html')
 
 @app.route('/request_property', methods=['GET', 'POST'])
 def request_property():
     if request.method == 'POST':
+        budget_min = float(request.form.get('min', 0) or 0)
+        budget_max = float(request.form.get('max', 0) or 0)
+        if budget_max and budget_min > budget_max:
+            budget_min, budget_max = budget_max, budget_min
         new_request = Request(
             user_name=request.form['name'],
             phone=request.form['phone'],
-            budget_min=float(request.form.get('min', 0) or 0),
-            budget_max=float(request.form.get('max', 0) or 0),
+            budget_min=budget_min,
+            budget_max=budget_max,
             district=request.form.get('district'),
             type=request.form.get('type'),
             notes=request.form.get('notes')
         )
         db.session.add(new_request)
         db.session.commit()
+        match_new_request(new_request)
         return redirect(url_for('home'))
     return render_template('request.html')
 
@@ -351,42 +2557,319 @@ def api_estimate_price():
     except Exception as e:
         return {'success': False, 'error': str(e)}, 400
 
+# --- Property API helpers ---
+
+# Every column exposed by /api/properties, in response order
+PROPERTY_FIELDS = (
+    'id', 'title', 'price', 'location', 'district', 'type', 'area', 'rooms',
+    'bathrooms', 'age', 'furnished', 'description', 'latitude', 'longitude',
+    'image_path', 'views', 'owner_id', 'external_id',
+)
+
+API_PAGE_SIZE_DEFAULT = 50
+API_PAGE_SIZE_MAX = 200  # Hard cap, larger exports must use stream=1
+API_STREAM_BATCH_SIZE = 500
+
+def parse_fields(raw):
+    """Parse a comma separated `fields=` projection, always keeping `id` for the cursor"""
+    if not raw:
+        return PROPERTY_FIELDS
+    requested = [f.strip() for f in raw.split(',') if f.strip()]
+    unknown = [f for f in requested if f not in PROPERTY_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    # Keep the canonical column order and drop duplicates
+    return tuple(f for f in PROPERTY_FIELDS if f == 'id' or f in requested)
+
+def parse_page_size(raw, default=API_PAGE_SIZE_DEFAULT, maximum=API_PAGE_SIZE_MAX):
+    """Clamp a `limit=` argument to 1..maximum"""
+    if raw in (None, ''):
+        return default
+    return max(1, min(int(raw), maximum))
+
+def property_rows(fields, cursor=None, limit=API_PAGE_SIZE_DEFAULT, descending=False):
+    """
+    Keyset page over the properties table, selecting only the projected columns.
+    Returns a list of dicts ordered by id.
+    """
+    columns = [getattr(Property, f) for f in fields]
+    rows = db.session.query(*columns)
+    if cursor is not None:
+        rows = rows.filter(Property.id < cursor if descending else Property.id > cursor)
+    rows = rows.order_by(Property.id.desc() if descending else Property.id.asc()).limit(limit)
+    return [dict(zip(fields, row)) for row in rows]
+
+def search_property_rows(fields, q, page=1, per_page=API_PAGE_SIZE_DEFAULT):
+    """
+    Page of full-text matches for q, best first, selecting only the projected columns.
+    Returns: (list of dicts, has_next)
+    """
+    columns = [getattr(Property, f) for f in fields]
+    rows = (search_index.match(db.session.query(*columns), q)
+            .order_by(search_index.rank(q), Property.id.desc())
+            .offset((page - 1) * per_page)
+            .limit(per_page + 1))
+    rows = [dict(zip(fields, row)) for row in rows]
+    return rows[:per_page], len(rows) > per_page
+
+def property_changes_query(since, fields, limit):
+    """Changes after `since` in sequence order, outer joined to the projected columns"""
+    columns = [getattr(Property, f) for f in fields]
+    return (db.select(PropertyChange.seq, PropertyChange.property_id, PropertyChange.deleted,
+                      PropertyChange.changed_at, *columns)
+            .outerjoin(Property, Property.id == PropertyChange.property_id)
+            .where(PropertyChange.seq > since)
+            .order_by(PropertyChange.seq)
+            .limit(limit))
+
+def change_entry(row, fields):
+    """One feed entry: the property's current columns, or a tombstone"""
+    entry = {'seq': row[0], 'id': row[1], 'deleted': bool(row[2]), 'changed_at': row[3].isoformat()}
+    if not entry['deleted']:
+        entry['property'] = dict(zip(fields, row[4:]))
+    return entry
+
+def property_changes(since, fields, limit=API_PAGE_SIZE_DEFAULT):
+    """
+    Page of the change feed.
+    Returns: (list of entries, has_more)
+    """
+    rows = db.session.execute(property_changes_query(since, fields, limit + 1)).all()
+    return [change_entry(row, fields) for row in rows[:limit]], len(rows) > limit
+
+def stream_properties_json(fields):
+    """Yield the whole inventory as one JSON document, one keyset batch at a time"""
+    yield '{"success": true, "properties": ['
+    cursor = None
+    first = True
+    count = 0
+    while True:
+        batch = property_rows(fields, cursor=cursor, limit=API_STREAM_BATCH_SIZE)
+        if not batch:
+            break
+        for row in batch:
+            yield ('' if first else ',') + json.dumps(row, ensure_ascii=False)
+            first = False
+        count += len(batch)
+        cursor = batch[-1]['id']
+        # Don't hold a transaction open between batches
+        db.session.rollback()
+    yield '], "count": %d}' % count
+
+ESTIMATE_BATCH_MAX = 100_000
+
+@app.route('/api/estimate_price/batch', methods=['POST'])
+def api_estimate_price_batch():
+    """
+    API endpoint for pricing many properties at once.
+    Accepts either columns ({"district": [...], "area": [...], ...}) or
+    records ({"properties": [{"district": ..., "area": ...}, ...]}).
+    """
+    data = request.get_json(silent=True) or {}
+    columns = ('district', 'area', 'rooms', 'bathrooms', 'age', 'furnished')
+
+    try:
+        if 'properties' in data:
+            records = data['properties']
+            batch = {c: [r.get(c) for r in records] for c in columns}
+        else:
+            batch = {c: data.get(c) for c in columns}
+        if batch['area'] is None:
+            raise ValueError('area is required')
+
+        n = len(batch['area'])
+        if n > ESTIMATE_BATCH_MAX:
+            raise ValueError(f'At most {ESTIMATE_BATCH_MAX} properties per batch')
+        # Same coercions as /api/estimate_price
+        districts = batch['district'] or ['Riyadh'] * n
+        districts = ['Riyadh' if d is None else d for d in districts]
+        furnished = ['no' if f is None else f for f in batch['furnished'] or ['no'] * n]
+        numeric = {c: None if batch[c] is None else [int(v or 0) for v in batch[c]]
+                   for c in ('rooms', 'bathrooms', 'age')}
+
+        estimated, low, high = estimate_property_prices(
+            districts, [float(a or 0) for a in batch['area']],
+            numeric['rooms'], numeric['bathrooms'], numeric['age'], furnished
+        )
+        return {
+            'success': True,
+            'count': n,
+            'estimated_price': estimated.tolist(),
+            'price_range_low': low.tolist(),
+            'price_range_high': high.tolist()
+        }
+    except Exception as e:
+        return {'success': False, 'error': str(e)}, 400
+
 @app.route('/api/properties', methods=['GET'])
+@cached_response
+@read_replica
 def api_get_properties():
-    """API endpoint to get all properties as JSON"""
+    """
+    API endpoint to list properties as JSON.
+
+    Query args:
+        fields  - comma separated projection, e.g. fields=id,title,price
+        limit   - page size (default 50, max 200)
+        cursor  - return rows after this id (use `next_cursor` from the previous page)
+        order   - 'asc' (default) or 'desc' by id
+        stream  - 1 to stream the full inventory ignoring limit/cursor
+        q       - full-text search; matches are ranked by relevance and paged
+                  with `page` (see `next_page`) instead of cursor/order
+    """
     try:
-        properties = Property.query.all()
-        properties_list = []
-        
-        for prop in properties:
-            properties_list.append({
-                'id': prop.id,
-                'title': prop.title,
-                'price': prop.price,
-                'location': prop.location,
-                'district': prop.district,
-                'type': prop.type,
-                'area': prop.area,
-                'rooms': prop.rooms,
-                'bathrooms': prop.bathrooms,
-                'age': prop.age,
-                'furnished': prop.furnished,
-                'description': prop.description,
-                'latitude': prop.latitude,
-                'longitude': prop.longitude,
-                'image_path': prop.image_path,
-                'views': prop.views,
-                'owner_id': prop.owner_id
-            })
-        
+        fields = parse_fields(request.args.get('fields'))
+        limit = parse_page_size(request.args.get('limit'))
+        cursor = int(request.args['cursor']) if request.args.get('cursor') else None
+        descending = request.args.get('order', 'asc') == 'desc'
+        page = max(1, int(request.args.get('page') or 1))
+    except ValueError as e:
+        return {'success': False, 'error': str(e)}, 400
+
+    if request.args.get('q'):
+        try:
+            properties_list, has_next = search_property_rows(fields, request.args['q'], page, limit)
+            return {
+                'success': True,
+                'count': len(properties_list),
+                'properties': properties_list,
+                'page': page,
+                'next_page': page + 1 if has_next else None
+            }
+        except Exception as e:
+            return {'success': False, 'error': str(e)}, 500
+
+    if request.args.get('stream') in ('1', 'true'):
+        return Response(stream_with_context(stream_properties_json(fields)),
+                        mimetype='application/json')
+
+    try:
+        # Fetch one extra row to know whether another page exists
+        properties_list = property_rows(fields, cursor=cursor, limit=limit + 1, descending=descending)
+        has_more = len(properties_list) > limit
+        properties_list = properties_list[:limit]
+
         return {
             'success': True,
             'count': len(properties_list),
-            'properties': properties_list
+            'properties': properties_list,
+            'next_cursor': properties_list[-1]['id'] if has_more else None
+        }
+    except Exception as e:
+        return {'success': False, 'error': str(e)}, 500
+
+@app.route('/api/properties/changes', methods=['GET'])
+def api_property_changes():
+    """
+    Change feed for mirrors: listings created, updated or deleted after a sequence number.
+
+    Query args:
+        since  - last `seq` the client has applied (default 0, the whole inventory)
+        limit  - changes per page (default 50, max 200); keep requesting from
+                 `next_since` while `has_more`
+        fields - projection of the changed properties, as for /api/properties
+    Each property appears once, at its latest change; deletions come as
+    tombstones with `deleted: true` and no `property`.
+
+    Long-polling (`wait=`) is only served by the ASGI entry point (asgi.py),
+    where a waiting client parks a coroutine rather than a sync worker.
+    """
+    try:
+        since = max(0, int(request.args.get('since') or 0))
+        limit = parse_page_size(request.args.get('limit'))
+        fields = parse_fields(request.args.get('fields'))
+        wait = float(request.args.get('wait') or 0)
+    except ValueError as e:
+        return {'success': False, 'error': str(e)}, 400
+    if wait > 0:
+        return {'success': False, 'error': 'wait= is only supported by the ASGI server (uvicorn asgi:app)'}, 400
+
+    try:
+        changes, has_more = property_changes(since, fields, limit)
+        return {
+            'success': True,
+            'count': len(changes),
+            'changes': changes,
+            'next_since': changes[-1]['seq'] if changes else since,
+            'has_more': has_more
         }
     except Exception as e:
         return {'success': False, 'error': str(e)}, 500
 
+@app.route('/api/properties/geo', methods=['GET'])
+def api_properties_geo():
+    """
+    API endpoint for map views.
+
+    Query args:
+        bbox            - south,west,north,east of the visible map
+        lat, lng, radius - alternatively a circle, radius in km
+        zoom            - cluster markers server-side for this zoom level
+        limit           - max points when not clustering (default/max 500)
+    The /browse filters (district, type, price_max, ...) apply as well.
+    """
+    try:
+        center = None
+        if request.args.get('bbox'):
+            south, west, north, east = parse_bbox(request.args['bbox'])
+        elif request.args.get('radius'):
+            center = (float(request.args['lat']), float(request.args['lng']))
+            radius = float(request.args['radius'])
+            south, west, north, east = radius_bbox(center[0], center[1], radius)
+        else:
+            raise ValueError('bbox or lat/lng/radius is required')
+        zoom = request.args.get('zoom', type=int)
+        limit = parse_page_size(request.args.get('limit'), default=GEO_POINT_LIMIT, maximum=GEO_POINT_LIMIT)
+        query = filter_bbox(filter_properties(Property.query, request.args), south, west, north, east)
+    except (KeyError, ValueError) as e:
+        return {'success': False, 'error': str(e)}, 400
+
+    try:
+        if zoom is not None and center is None:
+            clusters = cluster_properties(query, south, west, max(0, min(zoom, 22)))
+            return {'success': True, 'zoom': zoom, 'count': len(clusters), 'clusters': clusters}
+
+        fields = ('id', 'title', 'price', 'type', 'latitude', 'longitude')
+        rows = query.with_entities(*[getattr(Property, f) for f in fields])
+        points = []
+        truncated = False
+        # Newest first; radius matches are refined in Python, so stream instead of LIMIT
+        for row in rows.order_by(Property.id.desc()).yield_per(GEO_POINT_LIMIT):
+            point = dict(zip(fields, row))
+            if center is not None:
+                point['distance_km'] = round(haversine_km(center[0], center[1], row.latitude, row.longitude), 3)
+                if point['distance_km'] > radius:
+                    continue
+            if len(points) == limit:
+                truncated = True
+                break
+            points.append(point)
+        if center is not None:
+            points.sort(key=lambda p: p['distance_km'])
+        return {'success': True, 'count': len(points), 'truncated': truncated, 'points': points}
+    except Exception as e:
+        return {'success': False, 'error': str(e)}, 500
+
+@app.route('/api/stats', methods=['GET'])
+@cached_response
+@read_replica
+def api_market_stats():
+    """
+    Market statistics from the aggregate tables.
+
+    Query args:
+        district - only this district (any accepted spelling)
+        type     - only this property type
+        by       - 'type' for one row per district and type instead of per district
+    """
+    try:
+        district_key = normalize_district(request.args.get('district'))
+        stats = market_stats(district_key, request.args.get('type') or None,
+                             by_type=request.args.get('by') == 'type')
+        return {'success': True, 'totals': market_totals(), 'count': len(stats), 'stats': stats}
+    except Exception as e:
+        return {'success': False, 'error': str(e)}, 500
+
 @app.route('/api/add_property', methods=['POST'])
 def api_add_property():
     """API endpoint to add a new property to the database"""
@@ -401,26 +2884,11 @@ def api_add_property():
             }, 400
         
         # Create new property
-        new_property = Property(
-            title=data.get('title'),
-            price=float(data.get('price')),
-            location=data.get('location'),
-            district=data.get('district'),
-            type=data.get('type', 'villa'),
-            area=float(data.get('area', 0) or 0),
-            rooms=int(data.get('rooms', 0) or 0),
-            bathrooms=int(data.get('bathrooms', 0) or 0),
-            age=int(data.get('age', 0) or 0),
-            furnished=data.get('furnished', 'no'),
-            description=data.get('description'),
-            latitude=float(data.get('latitude', 0) or 0),
-            longitude=float(data.get('longitude', 0) or 0),
-            image_path=data.get('image_path'),
-            owner_id=data.get('owner_id', 1)
-        )
+        new_property = Property(**property_values(data))
         
         db.session.add(new_property)
         db.session.commit()
+        match_new_properties([new_property.id])
         
         return {
             'success': True,
@@ -436,11 +2904,154 @@ def api_add_property():
         db.session.rollback()
         return {'success': False, 'error': str(e)}, 500
 
+@app.route('/api/requests/<int:id>/matches', methods=['GET'])
+def api_request_matches(id):
+    """
+    API endpoint for the listings matching a buyer request, newest first.
+    Reads the precomputed request_matches rows and re-checks them against the
+    request, so listings whose price or district changed since are dropped.
+
+    Query args:
+        limit   - page size (default 50, max 200)
+        cursor  - return matches with a property id below this one
+    """
+    lead = db.session.get(Request, id)
+    if lead is None:
+        return {'success': False, 'error': 'Request not found'}, 404
+    try:
+        limit = parse_page_size(request.args.get('limit'))
+        cursor = request.args.get('cursor', type=int)
+    except ValueError as e:
+        return {'success': False, 'error': str(e)}, 400
+
+    fields = ('id', 'title', 'price', 'district', 'type', 'area', 'rooms', 'bathrooms', 'image_path')
+    query = (db.session.query(*[getattr(Property, f) for f in fields])
+             .join(RequestMatch, RequestMatch.property_id == Property.id)
+             .filter(RequestMatch.request_id == id))
+    query = request_match_filter(query, lead)
+    if cursor is not None:
+        query = query.filter(Property.id < cursor)
+    rows = [dict(zip(fields, row)) for row in query.order_by(Property.id.desc()).limit(limit + 1)]
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        'success': True,
+        'request_id': id,
+        'count': len(rows),
+        'matches': rows,
+        'next_cursor': rows[-1]['id'] if has_more else None
+    }
+
+@app.route('/api/properties/bulk', methods=['POST'])
+def api_bulk_import_properties():
+    """
+    API endpoint to import many properties from a JSON Lines or CSV body.
+
+    Query args:
+        format      - jsonl or csv (defaults from Content-Type, then jsonl)
+        chunk_size  - rows per insert batch (default 1000, max 10000)
+        upsert      - 1 to update properties whose external_id already exists
+    """
+    content_type = (request.mimetype or '').lower()
+    fmt = request.args.get('format') or IMPORT_FORMATS.get(content_type, 'jsonl')
+    if fmt not in ('jsonl', 'csv'):
+        return {'success': False, 'error': 'format must be jsonl or csv'}, 400
+    try:
+        chunk_size = parse_page_size(request.args.get('chunk_size'), default=IMPORT_CHUNK_SIZE,
+                                     maximum=IMPORT_CHUNK_SIZE_MAX)
+    except ValueError as e:
+        return {'success': False, 'error': str(e)}, 400
+
+    try:
+        rows = read_import_rows(io.BufferedReader(request.stream), fmt)
+        result = import_properties(rows, chunk_size=chunk_size,
+                                   upsert=request.args.get('upsert') in ('1', 'true'))
+        return {'success': True, **result}
+    except Exception as e:
+        db.session.rollback()
+        return {'success': False, 'error': str(e)}, 500
+
+@app.route('/api/snapshot/<table>.arrow', methods=['GET'])
+def api_snapshot(table):
+    """
+    Arrow IPC snapshot of a whole table, streamed one record batch at a time
+    and gzip-compressed when the client accepts it. `requests` holds buyer
+    contact details and is for admins only. Save the body and open it with
+    load_snapshot().
+    """
+    if table not in SNAPSHOT_TABLES:
+        abort(404)
+    if table == 'requests' and (current_user() or {}).get('role') != 'admin':
+        return {'success': False, 'error': 'Admins only'}, 403
+    compressor = (zlib.compressobj(SNAPSHOT_GZIP_LEVEL, zlib.DEFLATED, 31)  # 31: gzip container
+                  if request.accept_encodings['gzip'] else None)
+
+    def generate():
+        sink = io.BytesIO()
+
+        def drain():
+            data = sink.getvalue()
+            sink.seek(0)
+            sink.truncate()
+            return compressor.compress(data) if compressor else data
+
+        with snapshot_connection() as conn:
+            for _ in write_snapshot(conn, table, sink):
+                yield drain()
+        yield drain() + (compressor.flush() if compressor else b'')
+
+    response = Response(stream_with_context(generate()), mimetype=SNAPSHOT_MEDIA_TYPE)
+    response.headers['Content-Disposition'] = f'attachment; filename={table}.arrow'
+    response.vary.add('Accept-Encoding')
+    if compressor:
+        response.content_encoding = 'gzip'
+    return response
+
+@app.route('/media/<size>/<path:filename>')
+def media(size, filename):
+    """Serve an image size variant, falling back to the original until its thumbnail is ready"""
+    if size != 'original' and size not in IMAGE_SIZES:
+        abort(404)
+    folder = os.path.abspath(app.config['UPLOAD_FOLDER'])
+    immutable = is_content_addressed(filename)
+
+    if size != 'original':
+        for variant in variant_filenames(filename, size):
+            if os.path.exists(os.path.join(folder, variant)):
+                response = send_from_directory(folder, variant,
+                                               max_age=IMAGE_MAX_AGE if immutable else IMAGE_FALLBACK_MAX_AGE)
+                response.cache_control.immutable = immutable
+                return response
+
+    ready = size == 'original'
+    response = send_from_directory(folder, filename,
+                                   max_age=IMAGE_MAX_AGE if immutable and ready else IMAGE_FALLBACK_MAX_AGE)
+    response.cache_control.immutable = immutable and ready
+    return response
+
+@app.route('/i18n/<lang>.json')
+def i18n_bundle(lang):
+    """Client string bundle, cached forever when requested with its current hash (?v=)"""
+    if lang not in I18N_BUNDLES:
+        abort(404)
+    body, version = I18N_BUNDLES[lang]
+    response = Response(body, mimetype='application/json')
+    response.set_etag(version)
+    if request.args.get('v') == version:
+        response.cache_control.public = True
+        response.cache_control.max_age = I18N_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
 @app.route('/contact')
+@cached_response
 def contact():
     return render_template('contact.html')
 
 @app.route('/about')
+@cached_response
 def about():
     return render_template('about.html')
 
@@ -458,8 +3069,8 @@ def login():
         user = User.query.filter_by(name=username).first()
         
         if user and check_password_hash(user.password, password):
+            regenerate_session()
             session['user_id'] = user.id
-            session['user_name'] = user.name
             return redirect(url_for('dashboard'))
         else:
             flash('Invalid username or password')
@@ -492,16 +3103,153 @@ def logout():
 
 @app.route('/profile')
 def profile():
-    if 'user_id' not in session:
+    user = current_user()
+    if user is None:
         return redirect(url_for('login'))
-    
-    properties = Property.query.filter_by(owner_id=session['user_id']).all()
-    return render_template('profile.html', properties=properties)
 
-# Create tables on startup
-with app.app_context():
-    db.create_all()
+    properties = []
+    if user['property_ids']:
+        properties = Property.query.filter(Property.id.in_(user['property_ids'])).order_by(Property.id).all()
+    return render_template('profile.html', properties=properties, user=user)
+
+# --- Schema ---
+
+def add_column(conn, table, column):
+    column_type = column.type.compile(dialect=conn.dialect)
+    conn.execute(db.text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+
+def create_external_id_index(conn, index):
+    """
+    Build the unique external id index. Databases upgraded before it existed
+    may hold duplicates: the oldest property keeps the id, the others lose it
+    (and re-enter the change feed).
+    """
+    duplicates = conn.scalars(db.text(
+        'SELECT id FROM properties p WHERE external_id IS NOT NULL AND EXISTS '
+        '(SELECT 1 FROM properties o WHERE o.external_id = p.external_id AND o.id < p.id)'
+    )).all()
+    if duplicates:
+        conn.execute(db.update(Property.__table__).where(Property.id.in_(duplicates)).values(external_id=None))
+        record_property_changes(conn, duplicates)
+        print(f"Cleared duplicate external_id on {len(duplicates)} properties: {duplicates[:20]}")
+    index.create(conn)
+
+def schema_changes(conn):
+    """
+    Tables, columns and indexes the models define but the database lacks.
+    Returns: [(description, apply(conn))]
+    """
+    inspector = db.inspect(conn)
+    tables = set(inspector.get_table_names())
+    changes = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in tables:
+            # Creating the table creates its indexes too
+            changes.append((f'create table {table.name}', table.create))
+            continue
+        columns = {c['name'] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in columns:
+                changes.append((f'add column {table.name}.{column.name}',
+                                functools.partial(add_column, table=table, column=column)))
+        indexes = {i['name'] for i in inspector.get_indexes(table.name)}
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.name not in indexes:
+                apply = index.create
+                if index.name == 'ix_properties_external_id':
+                    apply = functools.partial(create_external_id_index, index=index)
+                changes.append((f'create index {index.name}', apply))
+    if 'property_search' not in tables:
+        # Indexes the existing properties, so it comes after their table
+        changes.append(('create search index property_search', search_index.create))
+    return changes
+
+def upgrade_schema():
+    """
+    Bring the database up to date: create missing tables, add missing
+    columns, create missing indexes and backfill derived columns.
+    Safe to run repeatedly. Returns the descriptions of the applied changes.
+    """
+    with db.engine.begin() as conn:
+        changes = schema_changes(conn)
+        for description, apply in changes:
+            apply(conn)
+
+        # Backfill normalized district keys
+        missing = conn.execute(db.text(
+            'SELECT id, district FROM properties WHERE district_key IS NULL AND district IS NOT NULL'
+        )).all()
+        if missing:
+            conn.execute(db.text('UPDATE properties SET district_key = :key WHERE id = :id'),
+                         [{'id': row.id, 'key': normalize_district(row.district)} for row in missing])
+
+        missing = conn.execute(db.text(
+            'SELECT id, district FROM requests WHERE district_key IS NULL AND district IS NOT NULL'
+        )).all()
+        if missing:
+            conn.execute(db.text('UPDATE requests SET district_key = :key WHERE id = :id'),
+                         [{'id': row.id, 'key': normalize_district(row.district)} for row in missing])
+
+        # Backfill geo grid cells
+        missing = conn.execute(db.text(
+            'SELECT id, latitude, longitude FROM properties WHERE geo_cell IS NULL AND latitude IS NOT NULL'
+        )).all()
+        missing = [{'id': row.id, 'cell': geo_cell_for(row.latitude, row.longitude)} for row in missing]
+        missing = [row for row in missing if row['cell'] is not None]
+        if missing:
+            conn.execute(db.text('UPDATE properties SET geo_cell = :cell WHERE id = :id'), missing)
+
+        # Aggregates start empty on databases that predate them
+        if (conn.scalar(db.select(MarketStat.district_key).limit(1)) is None
+                and conn.scalar(db.select(Property.id).limit(1)) is not None):
+            rebuild_market_stats(conn)
+
+        # Existing listings enter the change feed once
+        if (conn.scalar(db.select(PropertyChange.seq).limit(1)) is None
+                and conn.scalar(db.select(Property.id).limit(1)) is not None):
+            rebuild_property_changes(conn)
+
+    return [description for description, _ in changes]
+
+db_cli = AppGroup('db', help='Create and upgrade the database schema.')
+app.cli.add_command(db_cli)
+
+@db_cli.command('init')
+def db_init_command():
+    """Create every table and index in an empty database."""
+    if db.inspect(db.engine).get_table_names():
+        raise click.ClickException('The database already has tables, run flask db upgrade instead.')
+    applied = upgrade_schema()
+    click.echo(f'Created {len(applied)} tables')
+
+@db_cli.command('upgrade')
+def db_upgrade_command():
+    """Apply missing tables, columns and indexes, then backfill derived columns."""
+    start = time.perf_counter()
+    applied = upgrade_schema()
+    for description in applied:
+        click.echo(description)
+    click.echo(f'Schema up to date, {len(applied)} changes applied in {time.perf_counter() - start:.1f}s')
+
+@db_cli.command('status')
+def db_status_command():
+    """List pending schema changes; exits with status 1 when there are any."""
+    with db.engine.connect() as conn:
+        changes = schema_changes(conn)
+    for description, _ in changes:
+        click.echo(description)
+    if changes:
+        raise SystemExit(1)
+    click.echo('Schema up to date')
+
+# Importing this module does no I/O: the schema is managed with flask db
+# upgrade and the first request opens the first database connection, so a
+# preloaded app (gunicorn --preload object_app:app) forks into workers that
+# start serving immediately.
 
 if __name__ == '__main__':
+    # Local development server: bring the schema up to date first
+    with app.app_context():
+        upgrade_schema()
     port = int(os.environ.get('PORT', 10000))
-    app.run(host='0.0.0.0', port=port, debug=True)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=port, debug=True)